@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+
+"""
+Aggregates over a crawled dataset, computed with NumPy.
+
+A Dataset holds one array per column. State, city, characteristics and the
+participant fields are categorical: an array of integer codes plus the
+sorted list of their values, so that grouping by them is a single
+np.bincount. Characteristics and participants are flattened, with an array
+giving the incident each entry belongs to.
+
+Datasets load from the Parquet and Arrow outputs (needs pyarrow), which
+already hold typed and nested columns, or from the CSV output, whose nested
+columns have to be evaluated row by row once.
+"""
+
+import ast
+import collections
+import csv
+import os
+
+from writers import FORMATS, open_text, read_table, split_compression
+
+
+KEYS = ['year', 'month', 'year_month', 'state', 'city', 'characteristic']
+
+AGE_BINS = (0, 12, 18, 26, 35, 50, 65, 200)
+
+Aggregate = collections.namedtuple('Aggregate', ['keys', 'incidents', 'killed', 'injured'])
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise Exception("Analytics need numpy (pip install numpy).")
+    return numpy
+
+
+def _categorical(np, values):
+    """
+    (codes, categories) of a sequence of strings, None becoming ''.
+    """
+    values = np.array(['' if v is None else v for v in values], dtype=object)
+    if not len(values):
+        return np.zeros(0, dtype=np.int32), np.array([], dtype=object)
+    categories, codes = np.unique(values, return_inverse=True)
+    return codes.astype(np.int32), categories
+
+
+class Dataset:
+    """
+    Column arrays of a crawled dataset.
+
+    Incident columns: incident_id (0 when unknown), year, month, day, date
+    (datetime64[D]), killed, injured, latitude and longitude (NaN when
+    unknown), state and city (codes, with their categories in states and
+    cities). Flattened columns: characteristic (codes, categories in
+    characteristics) with characteristic_incident, and participant_incident,
+    age (NaN when unknown), gender and type (codes, categories in genders and
+    types).
+    """
+    def __init__(self, columns):
+        np = _numpy()
+        self._np = np
+        for name, value in columns.items():
+            setattr(self, name, value)
+        self.n = len(self.year)
+        months = (self.year.astype(np.int64) - 1970) * 12 + self.month.astype(np.int64) - 1
+        self.date = months.astype('datetime64[M]').astype('datetime64[D]') + (self.day.astype(np.int64) - 1)
+
+    @classmethod
+    def load(cls, filename):
+        name, _ = split_compression(filename)
+        ext = os.path.splitext(name)[1]
+        for fmt, fmt_ext in FORMATS.items():
+            if ext == fmt_ext and fmt != 'csv':
+                return cls.from_table(read_table(fmt, filename))
+        return cls.from_csv(filename)
+
+    @classmethod
+    def from_table(cls, table):
+        """
+        Dataset of a pyarrow table following writers.schema().
+        """
+        np = _numpy()
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        def numbers(name, dtype, fill):
+            return table.column(name).fill_null(fill).to_numpy().astype(dtype)
+
+        def categorical(array):
+            if hasattr(array, 'combine_chunks'):
+                array = array.combine_chunks()
+            if not pa.types.is_dictionary(array.type):
+                array = pc.dictionary_encode(pc.fill_null(array.cast(pa.string()), ''))
+            categories = np.array(['' if v is None else v for v in array.dictionary.to_pylist()], dtype=object)
+            order = np.argsort(categories)
+            rank = np.empty(len(order), dtype=np.int32)
+            rank[order] = np.arange(len(order), dtype=np.int32)
+            return rank[array.indices.to_numpy()], categories[order]
+
+        columns = {
+            'incident_id': numbers('incident_id', np.int64, 0),
+            'year': numbers('year', np.int16, 0),
+            'month': numbers('month', np.int8, 0),
+            'day': numbers('day', np.int8, 0),
+            'killed': numbers('num_killed', np.int32, 0),
+            'injured': numbers('num_injured', np.int32, 0),
+            'latitude': numbers('latitude', np.float64, float('nan')),
+            'longitude': numbers('longitude', np.float64, float('nan')),
+        }
+        columns['state'], columns['states'] = categorical(table.column('state'))
+        columns['city'], columns['cities'] = categorical(table.column('city_or_county'))
+
+        characteristics = table.column('characteristics').combine_chunks()
+        columns['characteristic_incident'] = pc.list_parent_indices(characteristics).to_numpy().astype(np.int64)
+        columns['characteristic'], columns['characteristics'] = categorical(pc.list_flatten(characteristics))
+
+        participants = table.column('participants').combine_chunks()
+        columns['participant_incident'] = pc.list_parent_indices(participants).to_numpy().astype(np.int64)
+        flat = pc.list_flatten(participants)
+        columns['age'] = pc.struct_field(flat, 'age').to_numpy(zero_copy_only=False).astype(np.float32)
+        columns['gender'], columns['genders'] = categorical(pc.struct_field(flat, 'gender'))
+        columns['type'], columns['types'] = categorical(pc.struct_field(flat, 'type'))
+        return cls(columns)
+
+    @classmethod
+    def from_csv(cls, filename):
+        """
+        Dataset of a CSV output, plain or compressed.
+        """
+        np = _numpy()
+        incident = collections.defaultdict(list)
+        characteristic_incident, characteristics = [], []
+        participant_incident, ages, genders, types = [], [], [], []
+
+        def number(value, cast=int, default=0):
+            try:
+                return cast(value)
+            except (TypeError, ValueError):
+                return default
+
+        with open_text(filename) as f:
+            for i, row in enumerate(csv.DictReader(f)):
+                incident['incident_id'].append(number(row['incident_link'].rstrip('/').rsplit('/', 1)[-1]))
+                incident['year'].append(number(row['year']))
+                incident['month'].append(number(row['month']))
+                incident['day'].append(number(row['day']))
+                incident['killed'].append(number(row['num_killed']))
+                incident['injured'].append(number(row['num_injured']))
+                incident['state'].append(row['state'])
+                incident['city'].append(row['city_or_county'])
+                lat = number(row['latitude'], float, float('nan'))
+                lon = number(row['longitude'], float, float('nan'))
+                if not lat and not lon:
+                    lat = lon = float('nan')
+                incident['latitude'].append(lat)
+                incident['longitude'].append(lon)
+
+                for c in ast.literal_eval(row['characteristics'] or '[]'):
+                    characteristic_incident.append(i)
+                    characteristics.append(c)
+                for p in ast.literal_eval(row['participants'] or '[]'):
+                    participant_incident.append(i)
+                    ages.append(number(p.get('Age'), float, float('nan')))
+                    genders.append(p.get('Gender'))
+                    types.append(p.get('Type'))
+
+        columns = {
+            'incident_id': np.array(incident['incident_id'], dtype=np.int64),
+            'year': np.array(incident['year'], dtype=np.int16),
+            'month': np.array(incident['month'], dtype=np.int8),
+            'day': np.array(incident['day'], dtype=np.int8),
+            'killed': np.array(incident['killed'], dtype=np.int32),
+            'injured': np.array(incident['injured'], dtype=np.int32),
+            'latitude': np.array(incident['latitude'], dtype=np.float64),
+            'longitude': np.array(incident['longitude'], dtype=np.float64),
+            'characteristic_incident': np.array(characteristic_incident, dtype=np.int64),
+            'participant_incident': np.array(participant_incident, dtype=np.int64),
+            'age': np.array(ages, dtype=np.float32),
+        }
+        columns['state'], columns['states'] = _categorical(np, incident['state'])
+        columns['city'], columns['cities'] = _categorical(np, incident['city'])
+        columns['characteristic'], columns['characteristics'] = _categorical(np, characteristics)
+        columns['gender'], columns['genders'] = _categorical(np, genders)
+        columns['type'], columns['types'] = _categorical(np, types)
+        return cls(columns)
+
+    def __key(self, key):
+        """
+        (codes, categories, incident index of every code or None) of a key.
+        """
+        np = self._np
+        if key == 'year':
+            first = int(self.year.min()) if self.n else 0
+            years = np.arange(first, int(self.year.max()) + 1 if self.n else 0)
+            return self.year.astype(np.int64) - first, years, None
+        if key == 'month':
+            return self.month.astype(np.int64) - 1, np.arange(1, 13), None
+        if key == 'year_month':
+            months = self.date.astype('datetime64[M]')
+            first = months.min() if self.n else np.datetime64('1970-01', 'M')
+            codes = (months - first).astype(np.int64)
+            count = int(codes.max()) + 1 if self.n else 0
+            return codes, np.arange(first, first + count).astype(str), None
+        if key == 'state':
+            return self.state, self.states, None
+        if key == 'city':
+            return self.city, self.cities, None
+        if key == 'characteristic':
+            return self.characteristic, self.characteristics, self.characteristic_incident
+        raise Exception("Unknown key [{}]. Choose among: {}.".format(key, ', '.join(KEYS)))
+
+    def group_by(self, *keys):
+        """
+        Incidents, killed and injured for every combination of the keys
+        present in the data. Grouping by characteristic counts an incident
+        once for each of its characteristics.
+        """
+        np = self._np
+        if not keys:
+            raise Exception("Group by what? Choose among: {}.".format(', '.join(KEYS)))
+
+        index = None  # incident of every entry, when some key is flattened
+        parts = []
+        for key in keys:
+            codes, categories, incident = self.__key(key)
+            if incident is not None:
+                if index is not None:
+                    raise Exception("Only one flattened key can be grouped by at a time.")
+                index = incident
+            parts.append((codes, categories, incident is not None))
+
+        combined = np.zeros(self.n if index is None else len(index), dtype=np.int64)
+        sizes = []
+        for codes, categories, flat in parts:
+            if index is not None and not flat:
+                codes = codes[index]
+            combined = combined * len(categories) + codes
+            sizes.append(len(categories))
+
+        length = int(np.prod(sizes)) if sizes else 0
+        killed, injured = (self.killed, self.injured) if index is None else (self.killed[index], self.injured[index])
+        incidents = np.bincount(combined, minlength=length)
+        killed = np.bincount(combined, weights=killed, minlength=length).astype(np.int64)
+        injured = np.bincount(combined, weights=injured, minlength=length).astype(np.int64)
+
+        present = np.nonzero(incidents)[0]
+        labels = np.unravel_index(present, sizes) if sizes else ()
+        key_values = [parts[i][1][labels[i]] for i in range(len(parts))]
+        return Aggregate(list(zip(*key_values)), incidents[present], killed[present], injured[present])
+
+    def daily(self):
+        """
+        (days, incidents, killed, injured) for every day from the first to
+        the last incident, days without incidents included.
+        """
+        np = self._np
+        if not self.n:
+            empty = np.zeros(0, dtype=np.int64)
+            return np.array([], dtype='datetime64[D]'), empty, empty, empty
+        first = self.date.min()
+        offsets = (self.date - first).astype(np.int64)
+        length = int(offsets.max()) + 1
+        days = np.arange(first, first + length)
+        return (
+            days,
+            np.bincount(offsets, minlength=length),
+            np.bincount(offsets, weights=self.killed, minlength=length).astype(np.int64),
+            np.bincount(offsets, weights=self.injured, minlength=length).astype(np.int64),
+        )
+
+    def rolling(self, window=30):
+        """
+        (days, incidents, killed, injured) summed over the `window` days
+        ending on every day.
+        """
+        np = self._np
+        days, *series = self.daily()
+        rolled = []
+        for values in series:
+            total = np.cumsum(values)
+            total[window:] = total[window:] - total[:-window]
+            rolled.append(total)
+        return (days,) + tuple(rolled)
+
+    def __participants(self, participant_type):
+        np = self._np
+        if participant_type is None:
+            return np.ones(len(self.age), dtype=bool)
+        matches = np.nonzero(self.types == participant_type)[0]
+        if not len(matches):
+            return np.zeros(len(self.age), dtype=bool)
+        return self.type == matches[0]
+
+    def age_breakdown(self, bins=AGE_BINS, participant_type='Victim'):
+        """
+        (labels, counts) of the participants of a type by age range, plus
+        an 'unknown' range for those whose age is missing.
+        """
+        np = self._np
+        ages = self.age[self.__participants(participant_type)]
+        known = ~np.isnan(ages)
+        counts, _ = np.histogram(ages[known], bins=bins)
+        labels = ['{}-{}'.format(bins[i], bins[i + 1] - 1) for i in range(len(bins) - 1)]
+        return labels + ['unknown'], np.append(counts, np.count_nonzero(~known))
+
+    def gender_breakdown(self, participant_type='Victim'):
+        """
+        (genders, counts) of the participants of a type.
+        """
+        np = self._np
+        counts = np.bincount(self.gender[self.__participants(participant_type)], minlength=len(self.genders))
+        return list(self.genders), counts
+
+    def age_gender_breakdown(self, bins=AGE_BINS, participant_type='Victim'):
+        """
+        (age labels, genders, matrix of counts) of the participants of a
+        type with a known age.
+        """
+        np = self._np
+        selected = self.__participants(participant_type) & ~np.isnan(self.age)
+        ranges = np.digitize(self.age[selected], bins) - 1
+        valid = (ranges >= 0) & (ranges < len(bins) - 1)
+        genders = len(self.genders)
+        cells = np.bincount(ranges[valid] * genders + self.gender[selected][valid],
+                            minlength=(len(bins) - 1) * genders)
+        labels = ['{}-{}'.format(bins[i], bins[i + 1] - 1) for i in range(len(bins) - 1)]
+        return labels, list(self.genders), cells.reshape(len(bins) - 1, genders)
+
+
+def write_aggregate(aggregate, keys, f):
+    """
+    Write a group_by result to the open file `f` as CSV.
+    """
+    writer = csv.writer(f)
+    writer.writerow(list(keys) + ['incidents', 'killed', 'injured'])
+    for key, incidents, killed, injured in zip(aggregate.keys, aggregate.incidents, aggregate.killed,
+                                               aggregate.injured):
+        writer.writerow([str(k) for k in key] + [int(incidents), int(killed), int(injured)])
+
+
+def write_series(series, f):
+    """
+    Write a daily or rolling result to the open file `f` as CSV.
+    """
+    writer = csv.writer(f)
+    writer.writerow(['date', 'incidents', 'killed', 'injured'])
+    days, incidents, killed, injured = series
+    for row in zip(days.astype(str), incidents.tolist(), killed.tolist(), injured.tolist()):
+        writer.writerow(row)
+
+
+def write_breakdown(labels, counts, f, column):
+    """
+    Write an age or gender breakdown to the open file `f` as CSV.
+    """
+    writer = csv.writer(f)
+    writer.writerow([column, 'participants'])
+    for label, count in zip(labels, counts.tolist()):
+        writer.writerow([label, count])
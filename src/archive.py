@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class Archive:
+    """
+    Append-only archive of raw HTTP responses, in the spirit of WARC.
+
+    Every record is a gzip member of its own holding a JSON header line
+    followed by the body, so the archive is a valid gzip stream and any
+    record can be decompressed alone from its offset. An index file next to
+    the archive (<archive>.idx, one JSON line per record) maps every URL to
+    the offset and length of its latest record.
+
+    A response whose body did not change since its last record is not
+    appended again.
+    """
+    def __init__(self, filename):
+        self._filename = filename
+        self._index_filename = '{}.idx'.format(filename)
+        self._lock = threading.Lock()
+        self._index = {}  # url -> index entry of its latest record
+        if os.path.exists(self._index_filename):
+            with open(self._index_filename) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._index[entry['url']] = entry
+        self._data = None
+        self._index_file = None
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def __open(self):
+        if self._data is None:
+            self._data = open(self._filename, 'ab')
+            self._index_file = open(self._index_filename, 'a')
+
+    def append(self, url, text, status=200):
+        body = text.encode('utf_8')
+        digest = hashlib.sha256(body).hexdigest()
+        with self._lock:
+            latest = self._index.get(url)
+            if latest is not None and latest['sha256'] == digest:
+                return False
+
+            self.__open()
+            header = {'url': url, 'status': status, 'date': time.time(), 'sha256': digest}
+            record = gzip.compress(json.dumps(header).encode('utf_8') + b'\n' + body)
+            offset = self._data.seek(0, os.SEEK_END)
+            self._data.write(record)
+            self._data.flush()
+
+            # the index line goes last: a crash in between only leaves an
+            # unreferenced record behind
+            entry = {'url': url, 'offset': offset, 'length': len(record), 'sha256': digest, 'date': header['date']}
+            self._index_file.write(json.dumps(entry) + '\n')
+            self._index_file.flush()
+            self._index[url] = entry
+            return True
+
+    def urls(self):
+        with self._lock:
+            return list(self._index)
+
+    def entry(self, url):
+        with self._lock:
+            return self._index.get(url)
+
+    def __contains__(self, url):
+        return self.entry(url) is not None
+
+    def get(self, url):
+        entry = self.entry(url)
+        if entry is None:
+            return None
+        return read_record(self._filename, entry['offset'], entry['length'])
+
+    def close(self):
+        with self._lock:
+            if self._data is not None:
+                self._data.close()
+                self._index_file.close()
+                self._data = None
+                self._index_file = None
+
+
+def read_record(filename, offset, length):
+    """
+    Body of the record stored at `offset`. A plain function so that worker
+    processes can read records by themselves.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        data = gzip.decompress(f.read(length))
+    _, body = data.split(b'\n', 1)
+    return body.decode('utf_8')
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the aggregates of analytics.py.
+
+Builds a synthetic dataset the size of the whole archive (by default
+500000 incidents from 2013 on, with a few characteristics and participants
+each), or loads a real output with --input, and prints the time taken by
+every aggregate and spatial query.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from analytics import AGE_BINS, Dataset
+from spatial import SpatialIndex
+
+
+STATES = 51
+CITIES = 20000
+CHARACTERISTICS = 120
+
+
+def synthetic(n, seed=0):
+    """
+    Dataset of `n` random incidents.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    dates = np.datetime64('2013-01-01') + rng.integers(0, 365 * 6, n)
+    years = dates.astype('datetime64[Y]')
+    months = dates.astype('datetime64[M]')
+    characteristics = rng.integers(1, 6, n)
+    participants = rng.integers(1, 5, n)
+    total = int(participants.sum())
+    ages = rng.integers(0, 90, total).astype(np.float32)
+    ages[rng.random(total) < 0.2] = np.nan
+
+    columns = {
+        'incident_id': np.arange(1, n + 1, dtype=np.int64),
+        'year': (years.astype(np.int64) + 1970).astype(np.int16),
+        'month': ((months - years).astype(np.int64) + 1).astype(np.int8),
+        'day': ((dates - months).astype(np.int64) + 1).astype(np.int8),
+        'killed': rng.poisson(0.3, n).astype(np.int32),
+        'injured': rng.poisson(0.6, n).astype(np.int32),
+        'latitude': rng.uniform(25, 49, n),
+        'longitude': rng.uniform(-124, -67, n),
+        'state': rng.integers(0, STATES, n).astype(np.int32),
+        'states': np.array(['State {:02d}'.format(i) for i in range(STATES)], dtype=object),
+        'city': rng.integers(0, CITIES, n).astype(np.int32),
+        'cities': np.array(['City {:05d}'.format(i) for i in range(CITIES)], dtype=object),
+        'characteristic_incident': np.repeat(np.arange(n), characteristics),
+        'characteristic': rng.integers(0, CHARACTERISTICS, int(characteristics.sum())).astype(np.int32),
+        'characteristics': np.array(['Characteristic {:03d}'.format(i) for i in range(CHARACTERISTICS)],
+                                    dtype=object),
+        'participant_incident': np.repeat(np.arange(n), participants),
+        'age': ages,
+        'gender': rng.integers(0, 2, total).astype(np.int32),
+        'genders': np.array(['Female', 'Male'], dtype=object),
+        'type': rng.integers(0, 2, total).astype(np.int32),
+        'types': np.array(['Subject-Suspect', 'Victim'], dtype=object),
+    }
+    return Dataset(columns)
+
+
+def timed(name, function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    print("  {:<28} {:8.1f} ms".format(name, 1000 * elapsed))
+    return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", help="Output to load instead of a synthetic dataset.")
+    parser.add_argument("-n", "--incidents", help="Incidents of the synthetic dataset (default 500000).",
+                        type=int, default=500000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    dataset = Dataset.load(args.input) if args.input else synthetic(args.incidents)
+    print("{} incidents, {} characteristics, {} participants, built in {:.2f} s".format(
+        dataset.n, len(dataset.characteristic), len(dataset.age), time.perf_counter() - start))
+
+    total = 0
+    for keys in [('year',), ('year_month',), ('state',), ('state', 'year'), ('state', 'city'),
+                 ('characteristic',), ('year', 'characteristic')]:
+        total += timed('group by ' + ', '.join(keys), dataset.group_by, *keys)
+    total += timed('rolling 30 days', dataset.rolling, 30)
+    total += timed('victims by age', dataset.age_breakdown, AGE_BINS)
+    total += timed('victims by gender', dataset.gender_breakdown)
+    total += timed('victims by age and gender', dataset.age_gender_breakdown, AGE_BINS)
+    print("all aggregates: {:.1f} ms".format(1000 * total))
+
+    start = time.perf_counter()
+    index = SpatialIndex.from_dataset(dataset)
+    print("spatial index of {} incidents built in {:.1f} ms".format(len(index), 1000 * (time.perf_counter() - start)))
+    timed('within 25 km of Houston', index.within, 29.76, -95.37, 25)
+    timed('within 250 km of Houston', index.within, 29.76, -95.37, 250)
+    timed('10 nearest to Houston', index.nearest, 29.76, -95.37, 10)
+    timed('box around Texas', index.bbox, 25.8, -106.7, 36.5, -93.5)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'index.npz')
+        timed('save index', index.save, filename)
+        timed('load index', SpatialIndex.load, filename)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+"""
+End to end benchmark of the crawler against a local fixture server.
+
+Serves synthetic listing and incident pages (see fixtures.py) with the
+given latency and error rate, runs ShootingsCrawler over them for every
+year asked (by default one year of each listing layout) and prints the
+incidents per second, the peak RSS of the crawler process and the time
+spent in every stage. Nothing leaves the machine and the response cache is
+not used, so runs can be compared with each other.
+"""
+
+import argparse
+import os
+import resource
+import time
+
+from fixtures import FixtureServer
+from metrics import Registry
+from orchestrator import parse_years
+import shootings
+
+
+STAGES = [
+    ('rate limiter wait', 'shootings_ratelimit_wait_seconds'),
+    ('fetch', 'shootings_fetch_seconds'),
+    ('listing parse', 'shootings_listing_parse_seconds'),
+    ('incident parse', 'shootings_incident_parse_seconds'),
+    ('write', 'shootings_write_seconds'),
+]
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process, in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def crawl(url, year, argv, registry):
+    shootings.BASE_URL = url
+    args = shootings.create_parser().parse_args(['-y', str(year), '-t', '0', '--no-cache'] + argv)
+    crawler = shootings.ShootingsCrawler(args=args, metrics=registry)
+    crawler.run()
+    return crawler.output
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--error-rate", help="Share of requests answered with a 503 (default 0).",
+                        type=float, default=0)
+    parser.add_argument("-f", "--format", help="Output format (default csv).", default='csv')
+    parser.add_argument("-j", "--workers", help="Number of incidents fetched concurrently (default 8).",
+                        type=int, default=8)
+    parser.add_argument("-l", "--latency", help="Seconds the server takes to answer (default 0.01).",
+                        type=float, default=0.01)
+    parser.add_argument("-n", "--pages", help="Listing pages per year, minus one (default 7).", type=int, default=7)
+    parser.add_argument("-P", "--parser", help="HTML parser (default auto).", default='auto')
+    parser.add_argument("--processes", help="Number of parsing processes (default 0).", type=int, default=0)
+    parser.add_argument("-Y", "--years", help="Years crawled one after the other (default 2015,2018).",
+                        default='2015,2018')
+    args = parser.parse_args()
+
+    argv = ['-j', str(args.workers), '-f', args.format, '-P', args.parser, '--processes', str(args.processes),
+            '-o', 'bench-crawl']
+    registry = Registry()
+    incidents = registry.counter('shootings_incidents_total', "Incidents written.")
+
+    with FixtureServer(pages=args.pages, latency=args.latency, error_rate=args.error_rate) as server:
+        start = time.perf_counter()
+        for year in parse_years(args.years):
+            output = crawl(server.url, year, argv, registry)
+            os.remove(os.path.join('..', 'out', output))
+        elapsed = time.perf_counter() - start
+
+    print("{} incidents in {:.2f} s: {:.1f} incidents/s".format(incidents.total(), elapsed,
+                                                                incidents.total() / elapsed))
+    print("peak RSS: {:.1f} MB".format(peak_rss()))
+    print("time per stage (summed over workers):")
+    for name, metric in STAGES:
+        histogram = registry.get(metric)
+        if histogram is None or not histogram.count:
+            continue
+        print("  {:<18} {:8.3f} s  {:8.3f} ms each  (n={})".format(
+            name, histogram.sum, 1000 * histogram.sum / histogram.count, histogram.count
+        ))
+    retries = registry.get('shootings_retries_total')
+    if retries is not None and retries.total():
+        print("retries: {}".format(retries.total()))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+"""
+Memory and CPU cost of Incident objects.
+
+Builds N incidents the way the crawler does (nine listing fields plus the
+additional info of the incident page), then reads their hashes, and prints
+the time spent and the memory held per 100k incidents.
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from incident import Incident
+
+
+PARTICIPANTS = [
+    {'Type': 'Victim', 'Name': 'Person {}', 'Age': '25', 'Age Group': 'Adult 18+', 'Gender': 'Male',
+     'Status': 'Killed'},
+    {'Type': 'Victim', 'Age': '33', 'Age Group': 'Adult 18+', 'Gender': 'Female', 'Status': 'Injured'},
+    {'Type': 'Victim', 'Age Group': 'Child 0-11', 'Gender': 'Male', 'Status': 'Injured'},
+    {'Type': 'Subject-Suspect', 'Age Group': 'Adult 18+', 'Gender': 'Male', 'Status': 'Unharmed, Arrested'},
+]
+CHARACTERISTICS = [
+    'Shot - Wounded/Injured',
+    'Shot - Dead (murder, accidental, suicide)',
+    'Mass Shooting (4+ victims injured or killed excluding the subject/suspect/perpetrator, one location)',
+]
+
+
+def build(i):
+    # fresh strings for every incident, as they come out of the parser
+    incident = Incident()
+    incident.year = 2018
+    incident.month = 1 + i % 12
+    incident.day = 1 + i % 28
+    incident.state = ''.join(['Tex', 'as'])
+    incident.city_or_county = ''.join(['Hous', 'ton'])
+    incident.address = '{} block of Main St'.format(i)
+    incident.num_killed = str(i % 5)
+    incident.num_injured = str(i % 7)
+    incident.incident_link = 'http://www.gunviolencearchive.org/incident/{}'.format(1000000 + i)
+    incident.lat, incident.lon = '29.9225', '-90.0224'
+    incident.participants = [{''.join([k, '']): ''.join([v.format(i), '']) for k, v in p.items()}
+                             for p in PARTICIPANTS]
+    incident.characteristics = [''.join([c, '']) for c in CHARACTERISTICS]
+    incident.notes = 'Notes about incident {}.'.format(i)
+    incident.guns_involved = [{''.join(['Ty', 'pe']): ''.join(['Hand', 'gun']), 'Stolen': ''.join(['Unk', 'nown'])}]
+    incident.district = {'Congressional District': str(i % 30), 'State Senate District': str(i % 40)}
+    return incident
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--incidents", help="Number of incidents (default 100000).", type=int, default=100000)
+    args = parser.parse_args()
+
+    n = args.incidents
+    scale = 100000.0 / n
+
+    # memory and time are measured on separate runs, tracing allocations
+    # slows the build down a lot
+    gc.collect()
+    tracemalloc.start()
+    incidents = [build(i) for i in range(n)]
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del incidents
+
+    gc.collect()
+    start = time.perf_counter()
+    incidents = [build(i) for i in range(n)]
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for incident in incidents:
+        incident.sha256
+    hash_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for incident in incidents:
+        incident.sha256
+    cached_time = time.perf_counter() - start
+
+    print("per 100k incidents")
+    print("  build:       {:8.3f} s".format(build_time * scale))
+    print("  first hash:  {:8.3f} s".format(hash_time * scale))
+    print("  cached hash: {:8.3f} s".format(cached_time * scale))
+    print("  memory:      {:8.1f} MB".format(memory * scale / 1024 / 1024))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark of the parsing backends.
+
+Parses synthetic listing and incident pages (see fixtures.py) with every
+backend installed and prints the cost per page. It also checks that all the
+backends extract exactly the same data, whatever tags or comments the
+section headers hold.
+"""
+
+import argparse
+import re
+import time
+
+import fixtures
+import parsers
+
+
+# section headers as they could be marked up, all of which must be found
+HEADERS = [
+    r'<h2><span>\1</span></h2>',
+    r'<h2>\1<!-- x --></h2>',
+    r'<h2><!-- x -->\1</h2>',
+    r'<h2>\n  <b>\1</b>\n</h2>',
+]
+
+
+def header_variants(page):
+    """
+    The incident page with its section headers marked up in every way of
+    HEADERS.
+    """
+    return [re.sub(r'<h2>([^<]*)</h2>', header, page) for header in HEADERS]
+
+
+def bench(func, pages, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for page in pages:
+            func(page)
+        elapsed = (time.perf_counter() - start) / len(pages)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--pages", help="Number of incident pages parsed (default 50).", type=int, default=50)
+    parser.add_argument("-r", "--repeat", help="Number of repetitions, the best is kept (default 3).",
+                        type=int, default=3)
+    args = parser.parse_args()
+
+    incidents = [fixtures.incident_page(201800000 + i) for i in range(args.pages)]
+    listings = [fixtures.listing_page(2018, page, 12) for page in range(max(1, args.pages // 10))]
+
+    names = parsers.available()
+    backends = {name: parsers.get_parser(name) for name in names}
+
+    reference = None
+    for name in names:
+        result = [backends[name].parse_incident(page) for page in incidents]
+        result += [backends[name].parse_listing(page) for page in listings]
+        if reference is None:
+            reference = result
+        elif result != reference:
+            raise Exception("Backend {} does not extract the same data as {}.".format(name, names[0]))
+        for variant in header_variants(incidents[0]):
+            if backends[name].parse_incident(variant) != reference[0]:
+                raise Exception("Backend {} does not find the sections of headers marked up as {}.".format(
+                    name, re.search(r'<h2>.*?</h2>', variant, re.S).group(0)))
+
+    print("{:<12} {:>16} {:>16}".format('backend', 'incident (ms)', 'listing (ms)'))
+    for name in names:
+        incident_cost = bench(backends[name].parse_incident, incidents, args.repeat)
+        listing_cost = bench(backends[name].parse_listing, listings, args.repeat)
+        print("{:<12} {:>16.3f} {:>16.3f}".format(name, incident_cost * 1000, listing_cost * 1000))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+"""
+Startup cost of the command line.
+
+Runs the commands that scripts and cron jobs run most (-w, -c and a query
+on an empty store) under `python -X importtime`, several times each, and
+prints the time spent importing modules on top of what the interpreter
+imports by itself, with the modules that cost the most. Exits with status 1
+when a command goes over the budget or imports one of the modules that only
+crawls and analyses need, so that it can guard the startup time in CI.
+"""
+
+import argparse
+import compileall
+import os
+import subprocess
+import sys
+import tempfile
+
+from store import IncidentStore
+
+
+BUDGET = 50.0  # milliseconds
+
+# only crawls, analyses and some commands need these
+HEAVY = ['requests', 'dateutil', 'bs4', 'lxml', 'numpy', 'pyarrow', 'http.server', 'concurrent.futures.process']
+
+
+def import_times(argv, directory):
+    """
+    Import time of the modules of a run of `python argv`, as a dictionary of
+    module -> (self, cumulative) microseconds, and the total in milliseconds
+    of the modules imported at the top level.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + argv, cwd=directory,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    modules = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(own), int(cumulative))
+        if not name[1:].startswith(' '):
+            total += int(cumulative)
+    return modules, total / 1000.0
+
+
+def best(argv, directory, runs):
+    """
+    The run of `argv` with the least import time, the others being slowed
+    down by whatever else the machine was doing.
+    """
+    return min((import_times(argv, directory) for _ in range(runs)), key=lambda run: run[1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", "--budget", help="Milliseconds of imports allowed to every command on top of those of "
+                                               "the interpreter (default {}).".format(BUDGET),
+                        type=float, default=BUDGET)
+    parser.add_argument("-n", "--runs", help="Runs of every command, the fastest counts (default 5).",
+                        type=int, default=5)
+    parser.add_argument("-t", "--top", help="Costliest modules shown for every command (default 5).",
+                        type=int, default=5)
+    args = parser.parse_args()
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    # as after the first run, even with PYTHONDONTWRITEBYTECODE set
+    compileall.compile_dir(directory, maxlevels=0, quiet=1)
+    builtin, interpreter = best(['-c', 'pass'], directory, args.runs)
+    print("interpreter: {:.1f} ms of imports".format(interpreter))
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        store = os.path.join(tmp, 'incidents.sqlite')
+        IncidentStore(store).close()
+        commands = [
+            ['shootings.py', '-w'],
+            ['shootings.py', '-c'],
+            ['shootings.py', 'query', store, '--limit', '1'],
+        ]
+        for argv in commands:
+            modules, total = best(argv, directory, args.runs)
+            cost = total - interpreter
+            heavy = [name for name in HEAVY if name in modules]
+            ok = cost <= args.budget and not heavy
+            failed = failed or not ok
+            print("{}: {:.1f} ms of imports, {:.1f} ms over the interpreter (budget {:.1f} ms) {}".format(
+                ' '.join(argv[1:]).replace(tmp, '<tmp>'), total, cost, args.budget, 'ok' if ok else 'FAILED'))
+            if heavy:
+                print("    imports {}".format(', '.join(heavy)))
+            own_modules = [(name, times) for name, times in modules.items() if name not in builtin]
+            costliest = sorted(own_modules, key=lambda item: item[1][0], reverse=True)[:args.top]
+            for name, (own, _) in costliest:
+                print("    {:>8.1f} ms  {}".format(own / 1000.0, name))
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import sqlite3
+import threading
+import time
+import zlib
+
+
+LISTING_TTL = 60 * 60  # one hour
+INCIDENT_TTL = 30 * 24 * 60 * 60  # thirty days
+MAX_SIZE = 512 * 1024 * 1024  # bytes
+
+CacheEntry = collections.namedtuple('CacheEntry', ['text', 'etag', 'last_modified', 'fetched_at'])
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class ResponseCache:
+    """
+    On-disk HTTP response cache backed by SQLite and keyed by URL.
+
+    Bodies are stored zlib-compressed. Incident pages rarely change once
+    published so they live much longer than listing pages. When the stored
+    bodies grow over `max_size` bytes the least recently used entries are
+    evicted.
+    """
+    def __init__(self, filename, listing_ttl=LISTING_TTL, incident_ttl=INCIDENT_TTL, max_size=MAX_SIZE):
+        self._listing_ttl = listing_ttl
+        self._incident_ttl = incident_ttl
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            '  url TEXT PRIMARY KEY,'
+            '  body BLOB NOT NULL,'
+            '  etag TEXT,'
+            '  last_modified TEXT,'
+            '  fetched_at REAL NOT NULL,'
+            '  accessed_at REAL NOT NULL,'
+            '  size INTEGER NOT NULL'
+            ')'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self._conn.commit()
+        self._size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def ttl(self, url):
+        if '/incident/' in url:
+            return self._incident_ttl
+        return self._listing_ttl
+
+    def is_fresh(self, url, entry):
+        return time.time() - entry.fetched_at < self.ttl(url)
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT body, etag, last_modified, fetched_at FROM responses WHERE url = ?', (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE responses SET accessed_at = ? WHERE url = ?', (time.time(), url))
+            self._conn.commit()
+
+        body, etag, last_modified, fetched_at = row
+        return CacheEntry(zlib.decompress(body).decode('utf_8'), etag, last_modified, fetched_at)
+
+    def put(self, url, text, etag=None, last_modified=None):
+        body = zlib.compress(text.encode('utf_8'))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (url, body, etag, last_modified, fetched_at, accessed_at, size) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, body, etag, last_modified, now, now, len(body))
+            )
+            self._size += len(body) - (old[0] if old else 0)
+            self.__evict()
+            self._conn.commit()
+
+    def touch(self, url):
+        """
+        Mark a cached response as fresh again, e.g. after a 304.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute('UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE url = ?', (now, now, url))
+            self._conn.commit()
+
+    def __evict(self):
+        if self._size <= self._max_size:
+            return
+
+        cursor = self._conn.execute('SELECT url, size FROM responses ORDER BY accessed_at')
+        evicted = []
+        for url, size in cursor:
+            if self._size <= self._max_size:
+                break
+            evicted.append((url,))
+            self._size -= size
+        self._conn.executemany('DELETE FROM responses WHERE url = ?', evicted)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
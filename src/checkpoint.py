@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+
+class Checkpoint:
+    """
+    Durable record of the progress of a crawl.
+
+    Keeps the listing pages completely written, the ids of the incidents
+    already written and the size of the output file at that point. Every save writes
+    a temporary file and atomically renames it over the previous checkpoint,
+    so a crash never leaves a half-written checkpoint behind.
+    """
+    def __init__(self, filename):
+        self._filename = filename
+        self.reset()
+
+    def reset(self, year=None, offset=0):
+        self.year = year
+        self.pages = set()
+        self.incidents = set()
+        self.offset = offset
+
+    def exists(self):
+        return os.path.exists(self._filename)
+
+    def load(self):
+        with open(self._filename) as f:
+            data = json.load(f)
+        self.year = data['year']
+        self.pages = set(data['pages'])
+        self.incidents = set(data['incidents'])
+        self.offset = data['offset']
+
+    def save(self):
+        data = {
+            'year': self.year,
+            'pages': sorted(self.pages),
+            'incidents': sorted(self.incidents),
+            'offset': self.offset,
+        }
+        tmp = '{}.tmp'.format(self._filename)
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._filename)
+
+    def mark(self, pages, incident_ids, offset):
+        self.pages.update(pages)
+        self.incidents.update(incident_ids)
+        self.offset = offset
+        self.save()
+
+    def remove(self):
+        if self.exists():
+            os.remove(self._filename)
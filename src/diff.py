@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+"""
+Changes between two crawl snapshots.
+
+Incidents are matched by their id and compared section by section (see
+incident.SECTIONS) through content hashes, so that an unchanged incident
+costs a string comparison. To diff full archive snapshots in bounded
+memory, both are first split (in two processes) by a hash of the incident
+id into `partitions` temporary files; only one partition of the old snapshot is
+held in memory at a time, while the matching partition of the new one is
+streamed against it.
+
+The changelog is a JSON Lines file, one change per line, in the order of
+the incident ids of every partition:
+
+    {"op": "add", "id": 1042, "record": {...}}
+    {"op": "remove", "id": 977}
+    {"op": "modify", "id": 1001, "sections": ["participants"],
+     "changes": {"participants": [<old value>, <new value>]}}
+
+Records hold the fields of incident.normalize(). Downstream systems apply
+the changes one by one with apply().
+"""
+
+import ast
+import csv
+import functools
+import json
+import os
+import shutil
+import tempfile
+
+from incident import SECTIONS, incident_id, normalize, section_hashes
+from writers import (DISTRICT_FIELDS, FORMATS, GUN_FIELDS, PARTICIPANT_FIELDS, open_text, split_compression)
+
+
+PARTITIONS = 32
+
+BATCH_SIZE = 10000
+
+
+# characteristics, guns and districts repeat a lot, participants hardly
+_literal_eval = functools.lru_cache(maxsize=4096)(ast.literal_eval)
+
+
+def _csv_records(filename):
+    with open_text(filename) as f:
+        for row in csv.DictReader(f):
+            row['participants'] = ast.literal_eval(row['participants']) if row['participants'] else None
+            for field in ('characteristics', 'guns_involved', 'district'):
+                # normalize() copies them, so sharing the cached values is safe
+                row[field] = _literal_eval(row[field]) if row[field] else None
+            yield row
+
+
+def _fields(struct, fields):
+    """
+    Struct of a columnar output back to the dictionary of the CSV output.
+    """
+    return {key: struct.get(name) for key, name in fields}
+
+
+def _columnar_records(fmt, filename):
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        batches = pq.ParquetFile(filename).iter_batches(batch_size=BATCH_SIZE)
+    else:
+        import pyarrow.ipc
+        reader = pyarrow.ipc.open_file(filename)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    for batch in batches:
+        for row in batch.to_pylist():
+            row['participants'] = [_fields(p, PARTICIPANT_FIELDS) for p in row['participants'] or []]
+            row['guns_involved'] = [_fields(g, GUN_FIELDS) for g in row['guns_involved'] or []]
+            row['district'] = _fields(row['district'] or {}, DISTRICT_FIELDS)
+            yield row
+
+
+def read_snapshot(filename):
+    """
+    Generator of the normalized records of an output, CSV (compressed or
+    not), Parquet or Arrow, read a few at a time.
+    """
+    name, _ = split_compression(filename)
+    ext = os.path.splitext(name)[1]
+    for fmt, fmt_ext in FORMATS.items():
+        if ext == fmt_ext and fmt != 'csv':
+            rows = _columnar_records(fmt, filename)
+            break
+    else:
+        rows = _csv_records(filename)
+    for row in rows:
+        yield normalize(row)
+
+
+def _partition(filename, directory, partitions):
+    """
+    Split a snapshot into `partitions` files of lines id<TAB>hashes<TAB>record.
+    Returns the filenames and the number of incidents without an id.
+    """
+    filenames = [os.path.join(directory, '{:03d}'.format(i)) for i in range(partitions)]
+    files = [open(name, 'w', encoding='utf_8') for name in filenames]
+    missing = 0
+    try:
+        for record in read_snapshot(filename):
+            key = incident_id(record['incident_link'])
+            if key is None:
+                missing += 1
+                continue
+            hashes = ','.join(section_hashes(record).values())
+            files[hash(key) % partitions].write('{}\t{}\t{}\n'.format(key, hashes, json.dumps(record)))
+    finally:
+        for f in files:
+            f.close()
+    return filenames, missing
+
+
+def _lines(filename):
+    with open(filename, encoding='utf_8') as f:
+        for line in f:
+            key, hashes, record = line.rstrip('\n').split('\t', 2)
+            yield int(key), hashes, record
+
+
+def _changes(old, new):
+    """
+    The modify change between two versions of an incident given as
+    (hashes, record) with the record still in JSON.
+    """
+    old_hashes, new_hashes = old[0].split(','), new[0].split(',')
+    old_record, new_record = json.loads(old[1]), json.loads(new[1])
+    sections, changes = [], {}
+    for (section, fields), old_hash, new_hash in zip(SECTIONS, old_hashes, new_hashes):
+        if old_hash == new_hash:
+            continue
+        sections.append(section)
+        for field in fields:
+            if old_record[field] != new_record[field]:
+                changes[field] = [old_record[field], new_record[field]]
+    return sections, changes
+
+
+def diff(old_filename, new_filename, f, partitions=PARTITIONS, directory=None):
+    """
+    Write the changelog from the snapshot `old_filename` to `new_filename`
+    to the open file `f`. Returns the number of incidents added, removed,
+    modified and unchanged, and of those without an id, which are ignored.
+    """
+    counts = dict.fromkeys(['added', 'removed', 'modified', 'unchanged', 'without_id'], 0)
+    work = tempfile.mkdtemp(prefix='diff-', dir=directory)
+    try:
+        old_dir, new_dir = os.path.join(work, 'old'), os.path.join(work, 'new')
+        os.mkdir(old_dir)
+        os.mkdir(new_dir)
+        from concurrent.futures import ProcessPoolExecutor
+
+        # parsing and hashing dominate, so both snapshots are split at once
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            old_split = executor.submit(_partition, old_filename, old_dir, partitions)
+            new_split = executor.submit(_partition, new_filename, new_dir, partitions)
+            old_partitions, old_missing = old_split.result()
+            new_partitions, new_missing = new_split.result()
+        counts['without_id'] = old_missing + new_missing
+
+        for old_partition, new_partition in zip(old_partitions, new_partitions):
+            known = {key: (hashes, record) for key, hashes, record in _lines(old_partition)}
+            os.remove(old_partition)
+            changes = []
+            for key, hashes, record in _lines(new_partition):
+                previous = known.pop(key, None)
+                if previous is None:
+                    counts['added'] += 1
+                    changes.append((key, '{{"op": "add", "id": {}, "record": {}}}\n'.format(key, record)))
+                elif previous[0] == hashes:
+                    counts['unchanged'] += 1
+                else:
+                    counts['modified'] += 1
+                    sections, fields = _changes(previous, (hashes, record))
+                    changes.append((key, json.dumps({'op': 'modify', 'id': key, 'sections': sections,
+                                                     'changes': fields}) + '\n'))
+            os.remove(new_partition)
+            for key in known:
+                counts['removed'] += 1
+                changes.append((key, json.dumps({'op': 'remove', 'id': key}) + '\n'))
+            changes.sort()
+            for _, line in changes:
+                f.write(line)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return counts
+
+
+def read_changelog(filename):
+    """
+    Generator of the changes of a changelog, compressed or not.
+    """
+    with open_text(filename) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def apply(records, change):
+    """
+    Apply a change to `records`, a mapping of incident ids to normalized
+    records.
+    """
+    if change['op'] == 'add':
+        records[change['id']] = change['record']
+    elif change['op'] == 'remove':
+        records.pop(change['id'], None)
+    elif change['op'] == 'modify':
+        record = records[change['id']]
+        for field, (_, value) in change['changes'].items():
+            record[field] = value
+    else:
+        raise Exception("Unknown change [{}].".format(change['op']))
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""
+Synthetic pages mimicking the markup of gunviolencearchive.org.
+
+Used by the benchmarks so they can run without hitting the real site. Every
+page is generated deterministically from its year, page number or incident
+id. FixtureServer serves them over HTTP with the URLs of the site.
+"""
+
+import calendar
+import multiprocessing
+import random
+import re
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+STATES = [
+    ('Texas', 'Houston'), ('Illinois', 'Chicago'), ('California', 'Los Angeles'),
+    ('Louisiana', 'New Orleans'), ('Florida', 'Miami'), ('Pennsylvania', 'Philadelphia'),
+    ('Georgia', 'Atlanta'), ('Ohio', 'Cleveland'), ('Maryland', 'Baltimore'),
+    ('Missouri', 'Saint Louis'), ('Tennessee', 'Memphis'), ('New York', 'Brooklyn'),
+]
+
+CHARACTERISTICS = [
+    'Shot - Wounded/Injured',
+    'Shot - Dead (murder, accidental, suicide)',
+    'Mass Shooting (4+ victims injured or killed excluding the subject/suspect/perpetrator, one location)',
+    'Drive-by (car to street, car to car)',
+    'Gang involvement',
+    'Child Involved Incident',
+    'Drug involvement',
+    'Bar/club incident - in or around establishment',
+]
+
+GUN_TYPES = ['Handgun', '9mm', '.40 SW', '.45 Auto', '.223 Rem [AR-15]', 'Shotgun', 'Unknown']
+
+PER_PAGE = 25
+
+_HEADER = ''.join(
+    '<li class="leaf"><a href="/menu/{0}" title="Menu item {0}">Menu item {0}</a></li>'.format(i) for i in range(150)
+)
+_SCRIPT = 'var settings = {{{}}};'.format(','.join('"key{0}": "value{0}"'.format(i) for i in range(300)))
+
+
+def _page(content):
+    return (
+        '<!DOCTYPE html>\n<html lang="en"><head><title>Gun Violence Archive</title>'
+        '<script type="text/javascript">{}</script></head>\n'
+        '<body class="html not-front">\n<div id="page"><div id="header"><ul class="menu">{}</ul></div>\n'
+        '<div id="main"><div id="content" class="column">\n{}\n</div></div>\n'
+        '<div id="footer"><p>Gun Violence Archive</p></div></div>\n</body></html>'
+    ).format(_SCRIPT, _HEADER, content)
+
+
+def incident_ids(year, page, pages, per_page=PER_PAGE):
+    """
+    Ids of the incidents listed on a page, newest first.
+    """
+    first = year * 100000 + (pages - page + 1) * per_page
+    return list(range(first, first - per_page, -1))
+
+
+def _date(year, incident_id):
+    rnd = random.Random(incident_id)
+    month = rnd.randint(1, 12)
+    day = rnd.randint(1, calendar.monthrange(year, month)[1])
+    return "{} {}, {}".format(calendar.month_name[month], day, year)
+
+
+def listing_page(year, page, pages, per_page=PER_PAGE):
+    """
+    Listing page using the pre-2016 (reports/mass-shootings/<year>) or the
+    current (reports/mass-shooting?year=<year>) layout depending on the year.
+    """
+    rows = []
+    for incident_id in incident_ids(year, page, pages, per_page):
+        rnd = random.Random(incident_id)
+        state, city = rnd.choice(STATES)
+        rows.append(
+            '<tr class="odd"><td>{}</td><td>{}</td><td>{}</td><td>{} block of Main St</td><td>{}</td><td>{}</td>'
+            '<td><ul class="links inline"><li class="0 first"><a href="/incident/{}">View Incident</a></li>'
+            '<li class="1 last"><a href="http://example.com/news/{}">View Source</a></li></ul></td></tr>'.format(
+                _date(year, incident_id), state, city, rnd.randint(1, 9999), rnd.randint(0, 5), rnd.randint(0, 12),
+                incident_id, incident_id
+            )
+        )
+
+    if year < 2016:
+        last = '/reports/mass-shootings/{}?page={}'.format(year, pages)
+    else:
+        last = '/reports/mass-shooting?year={}&page={}'.format(year, pages)
+
+    return _page(
+        '<table class="sticky-enabled"><thead><tr><th>Incident Date</th><th>State</th><th>City Or County</th>'
+        '<th>Address</th><th># Killed</th><th># Injured</th><th>Operations</th></tr></thead>\n'
+        '<tbody>\n{}\n</tbody></table>\n'
+        '<h2 class="element-invisible">Pages</h2><div class="item-list"><ul class="pager">'
+        '<li class="pager-current first">1</li>'
+        '<li class="pager-last last"><a title="Go to last page" href="{}">last</a></li></ul></div>'.format(
+            '\n'.join(rows), last
+        )
+    )
+
+
+def incident_page(incident_id, year=2018):
+    rnd = random.Random(incident_id)
+    state, city = rnd.choice(STATES)
+
+    participants = []
+    for i in range(rnd.randint(4, 8)):
+        items = ['Type: {}'.format('Victim' if i else 'Subject-Suspect')]
+        if rnd.random() < 0.5:
+            items.append('Name: Person {}'.format(i))
+        if rnd.random() < 0.7:
+            age = rnd.randint(1, 70)
+            items.append('Age: {}'.format(age))
+            group = 'Adult 18+' if age >= 18 else 'Teen 12-17' if age >= 12 else 'Child 0-11'
+            items.append('Age Group: {}'.format(group))
+        items.append('Gender: {}'.format(rnd.choice(['Male', 'Female'])))
+        items.append('Status: {}'.format(rnd.choice(['Killed', 'Injured', 'Unharmed'])))
+        participants.append('<ul>{}</ul>'.format(''.join('<li>{}</li>'.format(item) for item in items)))
+
+    characteristics = rnd.sample(CHARACTERISTICS, rnd.randint(2, 5))
+    guns = ['<ul><li>Type: {}</li><li>Stolen: Unknown</li></ul>'.format(rnd.choice(GUN_TYPES))
+            for _ in range(rnd.randint(1, 3))]
+
+    return _page(
+        '<div id="block-system-main" class="block block-system"><div class="content">\n'
+        '<div>\n<h2>Location</h2>\n<h3>{date}</h3>\n<span>{address} block of Main St</span><br />\n'
+        '<span>{city}, {state}</span><br />\n<span>Geolocation: {lat:.4f}, {lon:.4f}</span>\n</div>\n'
+        '<div>\n<h2>Participants</h2>\n{participants}\n</div>\n'
+        '<div>\n<h2>Incident Characteristics</h2>\n<ul>{characteristics}</ul>\n</div>\n'
+        '<div>\n<h2>Notes</h2>\n<p>Notes about incident {incident_id}.</p>\n</div>\n'
+        '<div>\n<h2>Guns Involved</h2>\n{guns}\n</div>\n'
+        '<div>\n<h2>District</h2>\nCongressional District: {cd}<br />\nState Senate District: {ssd}<br />\n'
+        'State House District: {shd}<br />\n</div>\n'
+        '<div>\n<h2>Sources</h2>\n'
+        '<ul><li><a href="http://example.com/news/{incident_id}">Source</a></li></ul>\n</div>\n'
+        '</div></div>'.format(
+            date=_date(year, incident_id), address=rnd.randint(1, 9999), city=city, state=state,
+            lat=rnd.uniform(25, 48), lon=rnd.uniform(-124, -70), participants='\n'.join(participants),
+            characteristics=''.join('<li>{}</li>'.format(c) for c in characteristics),
+            incident_id=incident_id, guns='\n'.join(guns),
+            cd=rnd.randint(1, 30), ssd=rnd.randint(1, 40), shd=rnd.randint(1, 150)
+        )
+    )
+
+
+PRE_2016_PATH = re.compile(r'^/reports/mass-shootings/(\d{4})/?$')
+INCIDENT_PATH = re.compile(r'^/incident/(\d+)$')
+
+
+def _serve(conn, pages, per_page, latency, error_rate, seed):
+    rnd = random.Random(seed)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # headers and body go out in separate writes, which Nagle's algorithm
+        # would hold back for the delayed ACK of keep-alive connections
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            if error_rate and rnd.random() < error_rate:
+                self.__send(503, b'', {'Retry-After': '0'})
+                return
+
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            page = int(query.get('page', ['0'])[0])
+            m = PRE_2016_PATH.match(url.path)
+            if m and int(m.group(1)) < 2016:
+                body = listing_page(int(m.group(1)), page, pages, per_page)
+            elif url.path == '/reports/mass-shooting' and 'year' in query and int(query['year'][0]) >= 2016:
+                body = listing_page(int(query['year'][0]), page, pages, per_page)
+            else:
+                m = INCIDENT_PATH.match(url.path)
+                if m is None:
+                    self.__send(404, b'')
+                    return
+                incident_id = int(m.group(1))
+                body = incident_page(incident_id, year=incident_id // 100000)
+            self.__send(200, body.encode('utf_8'), {'Content-Type': 'text/html; charset=utf-8'})
+
+        def __send(self, status, body, headers=None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    conn.send(server.server_address[1])
+    server.serve_forever()
+
+
+class FixtureServer:
+    """
+    Local stand-in for gunviolencearchive.org serving the synthetic pages.
+
+    Every year has `pages` + 1 listing pages of `per_page` incidents, in the
+    pre-2016 or the current layout depending on the year. Every answer is
+    delayed by `latency` seconds and a share `error_rate` of them fail with
+    a 503. The server runs in a process of its own so that it does not
+    compete for the GIL with the crawler being measured.
+    """
+    def __init__(self, pages=4, per_page=PER_PAGE, latency=0, error_rate=0, seed=0):
+        self._args = (pages, per_page, latency, error_rate, seed)
+        self._process = None
+        self._port = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self._port)
+
+    def start(self):
+        parent, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(child,) + self._args, daemon=True)
+        self._process.start()
+        self._port = parent.recv()
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
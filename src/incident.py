@@ -1,10 +1,64 @@
 # -*- coding: utf-8 -*-
 
 import hashlib
+import json
+import sys
+
+from urllib.parse import urljoin
+
+
+CSV_HEADER = [
+    'sha256',
+    'year',
+    'month',
+    'day',
+    'state',
+    'city_or_county',
+    'address',
+    'num_killed',
+    'num_injured',
+    'incident_link',
+    'latitude',
+    'longitude',
+    'participants',
+    'characteristics',
+    'notes',
+    'guns_involved',
+    'district'
+]
+
+# parts of an incident that are hashed and compared separately, e.g. the
+# participants of an incident are often completed after its publication
+SECTIONS = [
+    ('listing', ['year', 'month', 'day', 'state', 'city_or_county', 'address', 'num_killed', 'num_injured',
+                 'incident_link']),
+    ('location', ['latitude', 'longitude']),
+    ('participants', ['participants']),
+    ('characteristics', ['characteristics']),
+    ('notes', ['notes']),
+    ('guns_involved', ['guns_involved']),
+    ('district', ['district']),
+]
 
 
 class Incident:
+    """
+    A mass shooting incident.
+
+    Slotted to keep the per instance footprint small. The SHA-256 over the
+    listing fields is computed lazily the first time it is read and cached
+    until one of those fields changes. Participants, guns and district are
+    kept as tuples of (key, value) pairs with interned keys and categorical
+    values; their properties still accept and return lists of dictionaries.
+    """
+    __slots__ = [
+        '_year', '_month', '_day', '_state', '_city_or_county', '_address', '_num_killed', '_num_injured',
+        '_incident_link', '_sha256', '_lat', '_lon', '_participants', '_characteristics', '_notes',
+        '_guns_involved', '_district',
+    ]
+
     def __init__(self, *args, **kwargs):
+        self._sha256 = None
         self.year = kwargs.get('year', 1970)
         self.month = kwargs.get('month', 1)
         self.day = kwargs.get('day', 1)
@@ -14,7 +68,6 @@ class Incident:
         self.num_killed = kwargs.get('num_killed', 0)
         self.num_injured = kwargs.get('num_injured', 0)
         self.incident_link = kwargs.get('incident_link', '')
-        self.sha256 = ''
         self.lat = kwargs.get('lat', 0)
         self.lon = kwargs.get('lon', 0)
         self.participants = []  # list of dictionaries
@@ -23,6 +76,30 @@ class Incident:
         self.guns_involved = []  # list of dictionaries
         self.district = {}  # dictionary
 
+    @classmethod
+    def from_listing_row(cls, row, base_url):
+        """
+        Build an incident from a row of a listing page, as returned by the
+        parsers: (date, state, city_or_county, address, num_killed,
+        num_injured, link).
+        """
+        # imported here, so that writers and the store do not pay for it
+        from dateutil.parser import parse
+
+        date, state, city_or_county, address, num_killed, num_injured, incident_link = row
+        incident = cls()
+        date = parse(date)
+        incident.year = date.year
+        incident.month = date.month
+        incident.day = date.day
+        incident.state = state
+        incident.city_or_county = city_or_county
+        incident.address = address
+        incident.num_killed = num_killed
+        incident.num_injured = num_injured
+        incident.incident_link = urljoin(base_url, incident_link)
+        return incident
+
     def __str__(self):
         return "{}/{}/{}, {}".format(self.year, self.month, self.day, self.incident_link)
     __repr__ = __str__
@@ -34,8 +111,7 @@ class Incident:
     @year.setter
     def year(self, val):
         self._year = val
-        if hasattr(self, 'sha256'):
-            self.sha256 = 1
+        self._sha256 = None
 
     @property
     def month(self):
@@ -44,8 +120,7 @@ class Incident:
     @month.setter
     def month(self, val):
         self._month = val
-        if hasattr(self, 'sha256'):
-            self.sha256 = 1
+        self._sha256 = None
 
     @property
     def day(self):
@@ -54,18 +129,7 @@ class Incident:
     @day.setter
     def day(self, val):
         self._day = val
-        if hasattr(self, 'sha256'):
-            self.sha256 = 1
-
-    @property
-    def state(self):
-        return self._state
-
-    @state.setter
-    def state(self, val):
-        self._state = val
-        if hasattr(self, 'sha256'):
-            self.sha256 = 1
+        self._sha256 = None
 
     @property
     def state(self):
@@ -74,8 +138,7 @@ class Incident:
     @state.setter
     def state(self, val):
         self._state = val
-        if hasattr(self, 'sha256'):
-            self.sha256 = 1
+        self._sha256 = None
 
     @property
     def city_or_county(self):
@@ -84,8 +147,7 @@ class Incident:
     @city_or_county.setter
     def city_or_county(self, val):
         self._city_or_county = val
-        if hasattr(self, 'sha256'):
-            self.sha256 = 1
+        self._sha256 = None
 
     @property
     def address(self):
@@ -94,8 +156,7 @@ class Incident:
     @address.setter
     def address(self, val):
         self._address = val
-        if hasattr(self, 'sha256'):
-            self.sha256 = 1
+        self._sha256 = None
 
     @property
     def num_killed(self):
@@ -104,8 +165,7 @@ class Incident:
     @num_killed.setter
     def num_killed(self, val):
         self._num_killed = val
-        if hasattr(self, 'sha256'):
-            self.sha256 = 1
+        self._sha256 = None
 
     @property
     def num_injured(self):
@@ -114,8 +174,7 @@ class Incident:
     @num_injured.setter
     def num_injured(self, val):
         self._num_injured = val
-        if hasattr(self, 'sha256'):
-            self.sha256 = 1
+        self._sha256 = None
 
     @property
     def incident_link(self):
@@ -124,20 +183,26 @@ class Incident:
     @incident_link.setter
     def incident_link(self, val):
         self._incident_link = val
-        if hasattr(self, 'sha256'):
-            self.sha256 = 1
+        self._sha256 = None
+
+    @property
+    def incident_id(self):
+        return incident_id(self.incident_link)
 
     @property
     def sha256(self):
+        if self._sha256 is None:
+            st = "{}{}{}{}{}{}{}{}{}".format(
+                self.year, self.month, self.day, self.state, self.city_or_county,
+                self.address, self.num_killed, self.num_injured, self.incident_link
+            )
+            self._sha256 = hashlib.sha256(st.encode(encoding='utf_8')).hexdigest()
         return self._sha256
 
     @sha256.setter
     def sha256(self, val):
-        st = "{}{}{}{}{}{}{}{}{}".format(
-            self.year, self.month, self.day, self.state, self.city_or_county,
-            self.address, self.num_killed, self.num_injured, self.incident_link
-        )
-        self._sha256 = hashlib.sha256(st.encode(encoding='utf_8')).hexdigest()
+        # the hash is always derived from the fields, assigning only resets it
+        self._sha256 = None
 
     @property
     def lat(self):
@@ -157,19 +222,19 @@ class Incident:
 
     @property
     def participants(self):
-        return self._participants
+        return [dict(p) for p in self._participants]
 
     @participants.setter
     def participants(self, val):
-        self._participants = val
+        self._participants = tuple(_pairs(p) for p in val)
 
     @property
     def characteristics(self):
-        return self._characteristics
+        return list(self._characteristics)
 
     @characteristics.setter
     def characteristics(self, val):
-        self._characteristics = val
+        self._characteristics = tuple(sys.intern(c) for c in val)
 
     @property
     def notes(self):
@@ -181,19 +246,19 @@ class Incident:
 
     @property
     def guns_involved(self):
-        return self._guns_involved
+        return [dict(g) for g in self._guns_involved]
 
     @guns_involved.setter
     def guns_involved(self, val):
-        self._guns_involved = val
+        self._guns_involved = tuple(_pairs(g) for g in val)
 
     @property
     def district(self):
-        return self._district
+        return dict(self._district)
 
     @district.setter
     def district(self, val):
-        self._district = val
+        self._district = _pairs(val)
 
     def to_csv(self):
         return [self.sha256, self.year, self.month, self.day, self.state, self.city_or_county,
@@ -201,5 +266,95 @@ class Incident:
                 self.lat, self.lon, self.participants, self.characteristics, self.notes,
                 self.guns_involved, self.district]
 
+    def to_record(self):
+        """
+        The fields of the incident as a normalized record, see normalize().
+        """
+        return normalize(dict(zip(CSV_HEADER, self.to_csv())))
+
+    def section_hashes(self):
+        """
+        Content hash of every section of the incident, see section_hashes().
+        """
+        return section_hashes(self.to_record())
+
     def __eq__(self, other):
         return self.sha256 == other.sha256
+
+
+# values of these keys are unique per participant, not worth interning
+NOT_INTERNED = frozenset(['Name'])
+
+
+def _pairs(data):
+    """
+    Dictionary as a tuple of (key, value) pairs, interning the keys and the
+    categorical values shared by many incidents.
+    """
+    return tuple(
+        (sys.intern(k), v if k in NOT_INTERNED or not isinstance(v, str) else sys.intern(v))
+        for k, v in data.items()
+    )
+
+
+def incident_id(incident_link):
+    """
+    Numeric id of an incident, taken from the last part of its link.
+    """
+    tail = (incident_link or '').rstrip('/').rsplit('/', 1)[-1]
+    if not tail.isdigit():
+        return None
+    return int(tail)
+
+
+def _number(value, cast):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _strings(data):
+    return {k: str(v) for k, v in data.items() if v is not None and v != ''}
+
+
+def normalize(record):
+    """
+    Record with the CSV_HEADER fields (but sha256) in a canonical form, so
+    that an incident compares equal whichever output it was read from:
+    numbers as numbers, 0, 0 coordinates as missing, and the values of
+    participants, guns and district as strings.
+    """
+    lat = _number(record.get('latitude'), float)
+    lon = _number(record.get('longitude'), float)
+    if not lat and not lon:
+        lat = lon = None
+    return {
+        'year': _number(record.get('year'), int),
+        'month': _number(record.get('month'), int),
+        'day': _number(record.get('day'), int),
+        'state': record.get('state') or '',
+        'city_or_county': record.get('city_or_county') or '',
+        'address': record.get('address') or '',
+        'num_killed': _number(record.get('num_killed'), int),
+        'num_injured': _number(record.get('num_injured'), int),
+        'incident_link': record.get('incident_link') or '',
+        'latitude': lat,
+        'longitude': lon,
+        'participants': [_strings(p) for p in record.get('participants') or []],
+        'characteristics': list(record.get('characteristics') or []),
+        'notes': record.get('notes') or '',
+        'guns_involved': [_strings(g) for g in record.get('guns_involved') or []],
+        'district': _strings(record.get('district') or {}),
+    }
+
+
+def section_hashes(record):
+    """
+    Short SHA-256 of every section of a normalized record, by section.
+    """
+    hashes = {}
+    for section, fields in SECTIONS:
+        content = json.dumps([record[field] for field in fields], sort_keys=True, separators=(',', ':'))
+        hashes[section] = hashlib.sha256(content.encode(encoding='utf_8')).hexdigest()[:16]
+    return hashes
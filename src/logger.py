@@ -1,28 +1,133 @@
 # -*- coding: utf-8 -*-
 
+"""
+Logging of the crawler, configured once per process.
+
+Records are put on an in-memory queue by a QueueHandler and written to the
+rotating log file by a QueueListener thread, so that crawl workers never
+wait for the disk. Messages use lazy %-style arguments and are formatted by
+the listener too, and only when their level is enabled. Lines are plain
+text or, with json_format, one JSON object per line.
+
+The log file and the listener thread are only created with the first
+record, so commands that log nothing (-w, -c) start nothing and leave no
+file behind.
+"""
+
+import atexit
+import json
 import logging
 import logging.handlers
 import os
+import queue
+import threading
+
+
+LOGGER = 'ShootingsLogger'
+
+FORMAT = '%(asctime)s %(processName)-10s %(name)s %(levelname)-8s %(message)s'
+
+_lock = threading.Lock()
+_records = None  # queue of the records, once configured
+_file = None  # arguments of the log file, until the listener starts
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record, with the exception traceback if any.
+    """
+    def format(self, record):
+        line = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'process': record.processName,
+            'thread': record.threadName,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            line['exception'] = self.formatException(record.exc_info)
+        return json.dumps(line)
 
 
-def get_logger(name='shootings.log', level=logging.INFO, maxbytes=1024, backupcount=5):
-    filename = os.path.join('..', 'logs', name)
-    logger = logging.getLogger('ShootingsLogger')
-    logger.setLevel(level)
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves the formatting to the listener. The queue never
+    leaves the process, so records need not be made picklable first.
+    """
+    def prepare(self, record):
+        return record
 
-    handler = logging.handlers.RotatingFileHandler(
-        filename=filename,
-        maxBytes=maxbytes,
-        backupCount=backupcount
-    )
-    f = logging.Formatter('%(asctime)s %(processName)-10s %(name)s %(levelname)-8s %(message)s')
-    handler.setFormatter(f)
-    logger.addHandler(handler)
+    def enqueue(self, record):
+        if _listener is None:
+            _start()
+        super().enqueue(record)
 
+
+def _start():
+    """
+    Open the log file and start the listener writing the queued records to it.
+    """
+    global _listener
+
+    with _lock:
+        if _listener is not None or _records is None:
+            return
+        name, maxbytes, backupcount, json_format = _file
+        handler = logging.handlers.RotatingFileHandler(
+            filename=os.path.join('..', 'logs', name),
+            maxBytes=maxbytes,
+            backupCount=backupcount
+        )
+        handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(FORMAT))
+        _listener = logging.handlers.QueueListener(_records, handler)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def get_logger(name='shootings.log', level=None, maxbytes=1024, backupcount=5, json_format=False):
+    """
+    The logger of the crawler. The first call configures it, writing to
+    ../logs/`name` from the first record on; later calls only change its
+    level when one is given.
+    """
+    global _records, _file
+
+    logger = logging.getLogger(LOGGER)
+    with _lock:
+        if _records is None:
+            _records = queue.SimpleQueue()
+            _file = (name, maxbytes, backupcount, json_format)
+            logger.addHandler(_QueueHandler(_records))
+            logger.propagate = False
+            logger.setLevel(logging.INFO if level is None else level)
+        elif level is not None:
+            logger.setLevel(level)
     return logger
 
 
+def shutdown():
+    """
+    Write the records still queued and close the log file.
+    """
+    global _records, _file, _listener
+
+    with _lock:
+        if _records is None:
+            return
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+        logger = logging.getLogger(LOGGER)
+        for handler in list(logger.handlers):
+            if isinstance(handler, _QueueHandler):
+                logger.removeHandler(handler)
+        _records = _file = _listener = None
+
+
 if __name__ == '__main__':
     my_log = get_logger(maxbytes=20)
     for i in range(20):
-        my_log.info('i = %d' % i)
+        my_log.info('i = %d', i)
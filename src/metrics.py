@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+"""
+Counters and histograms of a crawl, exported in the Prometheus text format.
+
+A Registry holds the metrics by name. It can be written to a file (for the
+textfile collector of node_exporter, or just to look at) and served over
+HTTP on /metrics by a MetricsExporter, which also rewrites the file every
+few seconds while the crawl runs.
+"""
+
+import bisect
+import os
+import threading
+import time
+
+
+# seconds, from a cached page to a slow server
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{{{}}}'.format(','.join('{}="{}"'.format(n, str(v).replace('"', '\\"')) for n, v in zip(names, values)))
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by the values of some labels.
+    """
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self._label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(tuple(labels), 0)
+
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+    def items(self):
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(self):
+        lines = []
+        for labels, value in self.items():
+            lines.append('{}{} {}'.format(self.name, _labels(self._label_names, labels), value))
+        if not lines:
+            lines.append('{} 0'.format(self.name))
+        return lines
+
+
+class Gauge:
+    """
+    Value that can go up and down, such as the current request rate.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        return self._value
+
+    def render(self):
+        return ['{} {}'.format(self.name, self._value)]
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets, with their count and
+    sum. Quantiles are estimated from the buckets.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self._buckets = tuple(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)  # last one is +Inf
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self._buckets, value)] += 1
+            self._count += 1
+            self._sum += value
+            self._max = max(self._max, value)
+
+    def time(self):
+        """
+        Context manager observing the time spent in its block.
+        """
+        return _Timer(self)
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-quantile.
+        """
+        with self._lock:
+            if not self._count:
+                return 0.0
+            rank = q * self._count
+            seen = 0
+            for bound, count in zip(self._buckets, self._counts):
+                seen += count
+                if seen >= rank:
+                    return min(bound, self._max)
+            return self._max
+
+    def render(self):
+        with self._lock:
+            lines = []
+            seen = 0
+            for bound, count in zip(self._buckets, self._counts):
+                seen += count
+                lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound, seen))
+            lines.append('{}_bucket{{le="+Inf"}} {}'.format(self.name, self._count))
+            lines.append('{}_sum {}'.format(self.name, self._sum))
+            lines.append('{}_count {}'.format(self.name, self._count))
+            return lines
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+
+class Registry:
+    """
+    Metrics of a crawl by name. Asking twice for the same name returns the
+    same metric, so several crawlers sharing a registry add up.
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+
+    def __get(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise Exception("Metric {} is not a {}.".format(name, cls.type))
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self.__get(Counter, name, help, labels)
+
+    def gauge(self, name, help):
+        return self.__get(Gauge, name, help)
+
+    def histogram(self, name, help, buckets=BUCKETS):
+        return self.__get(Histogram, name, help, buckets)
+
+    def get(self, name):
+        with self._lock:
+            return self._metrics.get(name)
+
+    def render(self):
+        """
+        All the metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        """
+        Write the metrics to `filename` atomically, so that a collector never
+        reads half a file.
+        """
+        tmp = '{}.tmp'.format(filename)
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, filename)
+
+    def summary(self):
+        """
+        Human readable lines summing up the run.
+        """
+        elapsed = time.time() - self._started
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = ['elapsed: {:.1f} s'.format(elapsed)]
+        for metric in metrics:
+            if isinstance(metric, Counter):
+                items = metric.items()
+                if len(items) > 1 or (items and items[0][0]):
+                    detail = ', '.join('{}={}'.format('/'.join(map(str, labels)), value) for labels, value in items)
+                    lines.append('{}: {} ({})'.format(metric.name, _number(metric.total()), detail))
+                else:
+                    lines.append('{}: {}'.format(metric.name, _number(metric.total())))
+            elif isinstance(metric, Gauge):
+                lines.append('{}: {}'.format(metric.name, _number(metric.value)))
+            elif metric.count:
+                lines.append('{}: n={} mean={:.4f} p50<={:.4f} p95<={:.4f} total={:.2f}'.format(
+                    metric.name,
+                    metric.count,
+                    metric.sum / metric.count,
+                    metric.quantile(0.5),
+                    metric.quantile(0.95),
+                    metric.sum
+                ))
+        return lines
+
+
+def _number(value):
+    if isinstance(value, float):
+        return '{:.2f}'.format(value)
+    return str(value)
+
+
+class MetricsExporter:
+    """
+    Expose a registry while the crawl runs: on http://<host>:<port>/metrics
+    and/or in a file rewritten every `interval` seconds and once more when
+    stopped.
+    """
+    def __init__(self, registry, filename=None, port=None, host='127.0.0.1', interval=10):
+        self._registry = registry
+        self._filename = filename
+        self._port = port
+        self._host = host
+        self._interval = interval
+        self._server = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._port is not None:
+            # http.server is costly to import and few runs serve the metrics
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+            registry = self._registry
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] not in ('/', '/metrics'):
+                        self.send_error(404)
+                        return
+                    body = registry.render().encode('utf_8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', CONTENT_TYPE)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer((self._host, self._port), Handler)
+            self._server.daemon_threads = True
+            self.__spawn(self._server.serve_forever)
+        if self._filename is not None:
+            self.__spawn(self.__write_periodically)
+        return self
+
+    def __spawn(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def __write_periodically(self):
+        while not self._stop.wait(self._interval):
+            self._registry.write(self._filename)
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        if self._filename is not None:
+            self._registry.write(self._filename)
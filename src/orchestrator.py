@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from writers import AtomicFile, merge_columnar, open_text, split_compression
+
+
+def parse_years(spec):
+    """
+    Parse a years specification such as '2013-2017', '2014,2016' or a mix of
+    both ('2013-2015,2018'). Returns a sorted list without duplicates.
+    """
+    years = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            first, last = int(first), int(last)
+            if first > last:
+                raise Exception("Invalid range of years [{}].".format(part))
+            years.update(range(first, last + 1))
+        else:
+            years.add(int(part))
+    if not years:
+        raise Exception("No years given in [{}].".format(spec))
+    return sorted(years)
+
+
+def year_output(output, year):
+    """
+    Name of the output file of a single year, e.g. output.csv -> output-2017.csv
+    or output.csv.gz -> output-2017.csv.gz
+    """
+    name, _ = split_compression(output)
+    stem, ext = os.path.splitext(name)
+    return "{}-{}{}{}".format(stem, year, ext, output[len(name):])
+
+
+class MultiYearCrawl:
+    """
+    Crawl several years concurrently and merge them into a single file.
+
+    `crawler_factory(year, output, progress)` must return a crawler for the
+    given year writing to the given output file. The factory is expected to
+    hand the same HTTP session to every crawler so that all of them share the
+    global request budget and the response cache. With `merge` False the
+    files of every year are left as they are.
+    """
+    def __init__(self, years, output, crawler_factory, directory=os.path.join('..', 'out'), fmt='csv', merge=True):
+        self._output = output
+        self._format = fmt
+        self._merge = merge
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._crawlers = [crawler_factory(year, year_output(output, year), self.__progress) for year in years]
+        self._logger = self._crawlers[0].get_logger()
+
+    def __progress(self, year, page, pages):
+        message = "[{}] page {}/{} done".format(year, page + 1, pages + 1)
+        with self._lock:
+            print(message)
+        self._logger.info(message)
+
+    def __crawl(self, crawler):
+        crawler.run()
+        message = "[{}] done".format(crawler.year)
+        with self._lock:
+            print(message)
+        self._logger.info(message)
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=len(self._crawlers)) as executor:
+            futures = [executor.submit(self.__crawl, crawler) for crawler in self._crawlers]
+        for future in futures:
+            # raises the exception of the first year that failed
+            future.result()
+
+        if not self._merge:
+            return None
+        return self.merge()
+
+    def merge(self):
+        """
+        Merge the output of every year into a single file, newest year first,
+        dropping incidents that appear more than once.
+        """
+        filename = os.path.join(self._directory, self._output)
+        crawlers = sorted(self._crawlers, key=lambda c: c.year, reverse=True)
+
+        if self._format != 'csv':
+            written = merge_columnar(
+                self._format,
+                [os.path.join(self._directory, crawler.output) for crawler in crawlers],
+                filename
+            )
+            self._logger.info("%d incidents merged into %s", written, filename)
+            return written
+
+        seen = set()
+        written = 0
+        _, compression = split_compression(filename)
+        with AtomicFile(filename, compression=compression) as f:
+            writer = csv.writer(f)
+            header = None
+            for crawler in crawlers:
+                with open_text(os.path.join(self._directory, crawler.output)) as year_file:
+                    reader = csv.reader(year_file)
+                    year_header = next(reader)
+                    if header is None:
+                        header = year_header
+                        writer.writerow(header)
+                    key = year_header.index('incident_link')
+                    for row in reader:
+                        if row[key] in seen:
+                            continue
+                        seen.add(row[key])
+                        writer.writerow(row)
+                        written += 1
+
+        self._logger.info("%d incidents merged into %s", written, filename)
+        return written
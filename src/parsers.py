@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+"""
+HTML parsing backends for the listing and incident pages.
+
+Every backend returns the same plain data, so they can be swapped freely:
+
+- parse_listing(html) returns the rows of the listing table as tuples of
+  (date, state, city_or_county, address, num_killed, num_injured, link) and
+  the link to the last page (None when there is no pager).
+- parse_incident(html) returns a dictionary with the Incident attributes
+  found in the page: lat, lon, participants, characteristics, notes,
+  guns_involved and district. Sections missing from the page are left out.
+
+All the sections of an incident page are located in a single pass over its
+h2 headers, using regular expressions compiled once.
+"""
+
+import re
+import time
+
+
+SECTIONS = [
+    ('participants', re.compile('Participants*')),
+    ('characteristics', re.compile('Incident Characteristics*')),
+    ('notes', re.compile('Notes*')),
+    ('guns_involved', re.compile('Guns Involved*')),
+    ('district', re.compile('District*')),
+]
+GEOLOCATION = re.compile('Geolocation*')
+
+
+def _header_text(text):
+    """
+    Title of a section header from its whole text, whatever tags or comments
+    it is split by, with the whitespace normalized. Every backend gives it the
+    text of all the descendants, so that all of them find the same sections.
+    """
+    return ' '.join(text.split()) if text else None
+
+
+def _locate_sections(headers):
+    """
+    Map every section name to the first (text, node) header matching it.
+    """
+    found = {}
+    for text, node in headers:
+        title = _header_text(text)
+        if not title:
+            continue
+        for name, regex in SECTIONS:
+            if name not in found and regex.search(title):
+                found[name] = node
+    return found
+
+
+def _lat_lon(text):
+    lat, lon = text.split(':')[1].strip().replace(' ', '').split(',')
+    return lat, lon
+
+
+def _key_values(texts):
+    kvs = {}
+    for t in texts:
+        if not t or ':' not in t:
+            continue
+        k, v = t.strip().split(':', 1)
+        kvs[k.strip()] = v.strip()
+    return kvs
+
+
+def _list(texts):
+    return [t.strip() for t in texts if t]
+
+
+def _notes(text):
+    if text is None:
+        return None
+    return text.strip()
+
+
+def _district(text):
+    return _key_values(text.replace('\nDistrict\n', '').split('\n'))
+
+
+class SoupParser:
+    """
+    BeautifulSoup backend. Works everywhere since bs4 is already required;
+    uses lxml as tree builder when `features` says so.
+    """
+    name = 'soup'
+
+    def __init__(self, features='html.parser'):
+        from bs4 import BeautifulSoup
+        self._soup = BeautifulSoup
+        self._features = features
+
+    def make_soup(self, html):
+        return self._soup(html, self._features)
+
+    def parse_listing(self, html):
+        data = self.make_soup(html)
+        rows = []
+        for row in data.find_all('tbody')[0].find_all('tr'):
+            columns = row.find_all('td')
+            link = columns[6].find('ul').find('li').find('a')['href']
+            rows.append(tuple(column.text for column in columns[:6]) + (link,))
+
+        last = data.find('li', attrs={'class': 'pager-last'})
+        if last is None:
+            return rows, None
+        return rows, last.find('a')['href']
+
+    def parse_incident(self, html):
+        data = self.make_soup(html)
+        fields = {}
+
+        # leaf spans only, as the other backends: .string looks through a single child tag
+        geo = next((span for span in data.find_all('span', string=GEOLOCATION) if span.find(True) is None), None)
+        if geo:
+            fields['lat'], fields['lon'] = _lat_lon(geo.text)
+
+        sections = _locate_sections((h2.get_text(), h2) for h2 in data.find_all('h2'))
+        for name in ('participants', 'guns_involved'):
+            if name in sections:
+                fields[name] = [_key_values(li.text for li in ul.find_all('li'))
+                                for ul in sections[name].parent.find_all('ul')]
+        if 'characteristics' in sections:
+            ul = sections['characteristics'].parent.find('ul')
+            fields['characteristics'] = _list(li.text for li in ul.find_all('li'))
+        if 'notes' in sections:
+            p = sections['notes'].parent.find('p')
+            if p is None or p.text:
+                fields['notes'] = _notes(p.text if p is not None else None)
+        if 'district' in sections:
+            fields['district'] = _district(sections['district'].parent.text)
+
+        return fields
+
+
+class LxmlParser:
+    """
+    lxml backend with precompiled XPath expressions.
+    """
+    name = 'lxml'
+
+    def __init__(self):
+        import lxml.html
+        from lxml import etree
+        self._fromstring = lxml.html.fromstring
+        self._rows = etree.XPath('(//tbody)[1]//tr')
+        self._pager_last = etree.XPath(
+            '(//li[contains(concat(" ", normalize-space(@class), " "), " pager-last ")])[1]//a/@href'
+        )
+        self._headers = etree.XPath('//h2')
+        self._spans = etree.XPath('//span[not(*)]')
+
+    def parse_listing(self, html):
+        data = self._fromstring(html)
+        rows = []
+        for row in self._rows(data):
+            columns = list(row.iter('td'))
+            link = next(next(columns[6].iter('ul')).iter('li'))
+            link = next(link.iter('a')).get('href')
+            rows.append(tuple(column.text_content() for column in columns[:6]) + (link,))
+
+        last = self._pager_last(data)
+        if not last:
+            return rows, None
+        return rows, last[0]
+
+    def parse_incident(self, html):
+        data = self._fromstring(html)
+        fields = {}
+
+        for span in self._spans(data):
+            if span.text and GEOLOCATION.search(span.text):
+                fields['lat'], fields['lon'] = _lat_lon(span.text_content())
+                break
+
+        sections = _locate_sections((h2.text_content(), h2) for h2 in self._headers(data))
+        for name in ('participants', 'guns_involved'):
+            if name in sections:
+                fields[name] = [_key_values(li.text_content() for li in ul.iter('li'))
+                                for ul in sections[name].getparent().iter('ul')]
+        if 'characteristics' in sections:
+            ul = next(sections['characteristics'].getparent().iter('ul'))
+            fields['characteristics'] = _list(li.text_content() for li in ul.iter('li'))
+        if 'notes' in sections:
+            p = next(sections['notes'].getparent().iter('p'), None)
+            if p is None or p.text_content():
+                fields['notes'] = _notes(p.text_content() if p is not None else None)
+        if 'district' in sections:
+            fields['district'] = _district(sections['district'].getparent().text_content())
+
+        return fields
+
+
+class SelectolaxParser:
+    """
+    selectolax (lexbor) backend.
+    """
+    name = 'selectolax'
+
+    def __init__(self):
+        from selectolax.lexbor import LexborHTMLParser
+        self._parser = LexborHTMLParser
+
+    def parse_listing(self, html):
+        data = self._parser(html)
+        rows = []
+        tbody = data.css_first('tbody')
+        for row in tbody.css('tr'):
+            columns = row.css('td')
+            link = columns[6].css_first('ul').css_first('li').css_first('a').attributes['href']
+            rows.append(tuple(column.text() for column in columns[:6]) + (link,))
+
+        last = data.css_first('li.pager-last a')
+        if last is None:
+            return rows, None
+        return rows, last.attributes['href']
+
+    def parse_incident(self, html):
+        data = self._parser(html)
+        fields = {}
+
+        for span in data.css('span:not(:has(*))'):
+            text = span.text()
+            if GEOLOCATION.search(text):
+                fields['lat'], fields['lon'] = _lat_lon(text)
+                break
+
+        sections = _locate_sections((h2.text(), h2) for h2 in data.css('h2'))
+        for name in ('participants', 'guns_involved'):
+            if name in sections:
+                fields[name] = [_key_values(li.text() for li in ul.css('li'))
+                                for ul in sections[name].parent.css('ul')]
+        if 'characteristics' in sections:
+            ul = sections['characteristics'].parent.css_first('ul')
+            fields['characteristics'] = _list(li.text() for li in ul.css('li'))
+        if 'notes' in sections:
+            p = sections['notes'].parent.css_first('p')
+            if p is None or p.text():
+                fields['notes'] = _notes(p.text() if p is not None else None)
+        if 'district' in sections:
+            fields['district'] = _district(sections['district'].parent.text())
+
+        return fields
+
+
+BACKENDS = {
+    'soup': SoupParser,
+    'lxml': LxmlParser,
+    'selectolax': SelectolaxParser,
+}
+
+
+def available():
+    """
+    Names of the backends whose libraries are installed, fastest first.
+    """
+    names = []
+    for name in ('selectolax', 'lxml', 'soup'):
+        try:
+            BACKENDS[name]()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_parser(name='auto'):
+    """
+    Instantiate a parsing backend by name. 'auto' picks the fastest one
+    installed and falls back to BeautifulSoup.
+    """
+    if name == 'auto':
+        name = available()[0]
+    if name not in BACKENDS:
+        raise Exception("Unknown parser [{}]. Choose one of: {}.".format(name, ', '.join(sorted(BACKENDS))))
+    try:
+        return BACKENDS[name]()
+    except ImportError as ex:
+        raise Exception("Parser [{}] is not available: {}".format(name, ex))
+
+
+_instances = {}
+
+
+def parse_incident(name, html):
+    """
+    Parse an incident page with the named backend, instantiated once per
+    process. Being a module level function it can be sent to a process pool.
+    """
+    parser = _instances.get(name)
+    if parser is None:
+        parser = _instances[name] = get_parser(name)
+    return parser.parse_incident(html)
+
+
+def timed_parse_incident(name, html):
+    """
+    parse_incident() and the seconds it took, measured in the process that
+    parsed the page.
+    """
+    start = time.perf_counter()
+    fields = parse_incident(name, html)
+    return fields, time.perf_counter() - start
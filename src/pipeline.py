@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import queue
+import threading
+
+
+_DONE = object()
+
+
+class Pipeline:
+    """
+    Streaming pipeline made of stages connected by bounded queues.
+
+    A source thread produces items, every stage runs its function on a
+    number of worker threads and the sink consumes the results in the calling
+    thread as soon as they are ready. The bounded queues keep a slow stage
+    from piling up work in memory: upstream stages block until there is room.
+
+    If any stage fails the source stops producing, the other stages drain
+    their queues without processing and the first exception is raised from
+    run().
+
+    Stages with several workers finish items out of order. With `ordered`
+    run() numbers the items of the source and the sink gets the results in
+    that order, the early ones waiting in a buffer no larger than the items
+    in flight, which the bounded queues already limit.
+    """
+    def __init__(self, queue_size=100):
+        self._queue_size = queue_size
+        self._stages = []
+        self._error = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, func, workers=1):
+        """
+        Append a stage running `func(item)` on `workers` threads. Items for
+        which `func` returns None are dropped.
+        """
+        self._stages.append((func, workers))
+
+    def __fail(self, ex):
+        with self._lock:
+            if self._error is None:
+                self._error = ex
+
+    @property
+    def failed(self):
+        return self._error is not None
+
+    def __produce(self, source, outq, downstream):
+        try:
+            for item in source:
+                if self._error is not None:
+                    break
+                outq.put(item)
+        except BaseException as ex:
+            self.__fail(ex)
+        finally:
+            for _ in range(downstream):
+                outq.put(_DONE)
+
+    def __work(self, func, inq, outq):
+        while True:
+            item = inq.get()
+            if item is _DONE:
+                return
+            if self._error is not None:
+                # keep draining so upstream stages never block on a full queue
+                continue
+            try:
+                result = func(item)
+            except BaseException as ex:
+                self.__fail(ex)
+                continue
+            if result is not None:
+                outq.put(result)
+
+    def __close(self, threads, outq, downstream):
+        for thread in threads:
+            thread.join()
+        for _ in range(downstream):
+            outq.put(_DONE)
+
+    def __start(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        return thread
+
+    @staticmethod
+    def __numbered(func):
+        """
+        Stage function on (number, item) pairs. Dropped items go on as
+        (number, None), so that the sink does not wait for them.
+        """
+        def run(pair):
+            number, item = pair
+            return number, None if item is None else func(item)
+        return run
+
+    @staticmethod
+    def __in_order(sink):
+        """
+        Sink of (number, result) pairs calling `sink(result)` in the order of
+        the numbers.
+        """
+        early = {}
+        expected = 0
+
+        def run(pair):
+            nonlocal expected
+            number, result = pair
+            early[number] = result
+            while expected in early:
+                result = early.pop(expected)
+                expected += 1
+                if result is not None:
+                    sink(result)
+        return run
+
+    def run(self, source, sink, ordered=False):
+        """
+        Feed the items of the `source` iterable through every stage and call
+        `sink(result)` for each result, in the calling thread, in the order
+        of the source when `ordered`.
+        """
+        queues = [queue.Queue(maxsize=self._queue_size) for _ in range(len(self._stages) + 1)]
+        workers = [stage_workers for _, stage_workers in self._stages] + [1]
+        stages = self._stages
+        if ordered:
+            source = enumerate(source)
+            stages = [(self.__numbered(func), stage_workers) for func, stage_workers in stages]
+            sink = self.__in_order(sink)
+
+        self.__start(self.__produce, source, queues[0], workers[0])
+        for i, (func, stage_workers) in enumerate(stages):
+            threads = [self.__start(self.__work, func, queues[i], queues[i + 1]) for _ in range(stage_workers)]
+            self.__start(self.__close, threads, queues[i + 1], workers[i + 1])
+
+        output = queues[-1]
+        while True:
+            result = output.get()
+            if result is _DONE:
+                break
+            if self._error is not None:
+                continue
+            try:
+                sink(result)
+            except BaseException as ex:
+                self.__fail(ex)
+
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+Queries over the incident store.
+
+Every filter becomes part of the WHERE clause, so SQLite answers with the
+indexes of the store (date, state and date, state and city, characteristic)
+instead of reading every incident, and rows are written out as the cursor
+yields them.
+"""
+
+import csv
+import json
+
+from store import COLUMNS, NESTED
+
+
+FORMATS = {
+    'csv': '.csv',
+    'jsonl': '.jsonl',
+}
+
+OUTPUT_COLUMNS = [column for column in COLUMNS if column != 'content_sha256'] + ['revision', 'updated_at']
+
+FETCH_SIZE = 1000
+
+
+def _year_ranges(years):
+    """
+    Group sorted years into (first, last) runs of consecutive years.
+    """
+    ranges = []
+    for year in years:
+        if ranges and ranges[-1][1] == year - 1:
+            ranges[-1][1] = year
+        else:
+            ranges.append([year, year])
+    return ranges
+
+
+class Query:
+    """
+    Filters over the incidents of the store. Unset filters match everything.
+    """
+    def __init__(self, years=None, month=None, state=None, city=None, min_killed=None, max_killed=None,
+                 min_injured=None, max_injured=None, characteristic=None, since=None, limit=None):
+        self.years = years
+        self.month = month
+        self.state = state
+        self.city = city
+        self.min_killed = min_killed
+        self.max_killed = max_killed
+        self.min_injured = min_injured
+        self.max_injured = max_injured
+        self.characteristic = characteristic
+        self.since = since
+        self.limit = limit
+
+    def sql(self):
+        """
+        SQL statement and parameters of the query.
+        """
+        where = []
+        params = []
+
+        if self.years:
+            # date ranges instead of year = ? so the date indexes are used
+            ranges = []
+            for first, last in _year_ranges(sorted(self.years)):
+                ranges.append('(date >= ? AND date < ?)')
+                params += ['{:04d}-01-01'.format(first), '{:04d}-01-01'.format(last + 1)]
+            where.append('({})'.format(' OR '.join(ranges)))
+        if self.month is not None:
+            where.append('month = ?')
+            params.append(self.month)
+        if self.state is not None:
+            where.append('state = ?')
+            params.append(self.state)
+        if self.city is not None:
+            where.append('city_or_county = ?')
+            params.append(self.city)
+        for column, op, value in [('num_killed', '>=', self.min_killed), ('num_killed', '<=', self.max_killed),
+                                  ('num_injured', '>=', self.min_injured), ('num_injured', '<=', self.max_injured)]:
+            if value is not None:
+                where.append('{} {} ?'.format(column, op))
+                params.append(value)
+        if self.characteristic is not None:
+            # a case insensitive prefix, which the NOCASE index can serve
+            where.append('incident_id IN (SELECT incident_id FROM incident_characteristics '
+                         "WHERE characteristic LIKE ? ESCAPE '\\')")
+            escaped = self.characteristic.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params.append(escaped + '%')
+        if self.since is not None:
+            where.append('updated_at >= ?')
+            params.append(self.since)
+
+        statement = 'SELECT {} FROM incidents'.format(', '.join(OUTPUT_COLUMNS))
+        if where:
+            statement += ' WHERE ' + ' AND '.join(where)
+        statement += ' ORDER BY date DESC, incident_id DESC'
+        if self.limit is not None:
+            statement += ' LIMIT ?'
+            params.append(self.limit)
+        return statement, params
+
+    def plan(self, store):
+        """
+        Query plan chosen by SQLite, to check which indexes are used.
+        """
+        statement, params = self.sql()
+        return [row[-1] for row in store.connection.execute('EXPLAIN QUERY PLAN ' + statement, params)]
+
+    def rows(self, store):
+        """
+        Generator of the matching incidents as dictionaries, fetched a few at
+        a time.
+        """
+        statement, params = self.sql()
+        cursor = store.connection.execute(statement, params)
+        try:
+            while True:
+                batch = cursor.fetchmany(FETCH_SIZE)
+                if not batch:
+                    break
+                for row in batch:
+                    yield dict(zip(OUTPUT_COLUMNS, row))
+        finally:
+            cursor.close()
+
+
+def export(rows, f, fmt='csv'):
+    """
+    Write rows to the open file `f` as CSV, with the nested fields as JSON,
+    or as JSON Lines. Returns the number of rows written.
+    """
+    written = 0
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(OUTPUT_COLUMNS)
+        for row in rows:
+            writer.writerow([row[column] for column in OUTPUT_COLUMNS])
+            written += 1
+    elif fmt == 'jsonl':
+        for row in rows:
+            for column in NESTED:
+                if row[column] is not None:
+                    row[column] = json.loads(row[column])
+            f.write(json.dumps(row) + '\n')
+            written += 1
+    else:
+        raise Exception("Unknown query format [{}].".format(fmt))
+    return written
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import random
+import threading
+import time
+
+
+MAX_RETRY_AFTER = 600  # seconds, longer Retry-After values are capped
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by all the workers of a crawl.
+
+    `rate` is the number of requests allowed per second and `capacity` the
+    number of requests that can be made in a burst after an idle period. A
+    rate of None (or 0) disables the limiter.
+    """
+    def __init__(self, rate, capacity=1):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_tbr(cls, tbr, capacity=1):
+        """
+        Build a bucket from a time between requests given in seconds.
+        """
+        if not tbr or tbr <= 0:
+            return cls(rate=None, capacity=capacity)
+        return cls(rate=1.0 / tbr, capacity=capacity)
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def _refill(self, now):
+        elapsed = now - self._last
+        self._last = now
+        if self._rate:
+            self._tokens = min(self._capacity, self._tokens + elapsed * self._rate)
+
+    def pause(self, seconds):
+        """
+        Hold every request for `seconds`, e.g. when the server sent a
+        Retry-After header.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def success(self, latency):
+        """
+        Called after every response from the network that was not an error.
+        """
+
+    def failure(self, retry_after=None):
+        """
+        Called after every throttled, failed or timed out request.
+        """
+        if retry_after:
+            self.pause(retry_after)
+
+    def acquire(self):
+        """
+        Take a token from the bucket, sleeping until one is available.
+
+        Tokens are reserved while holding the lock and the caller sleeps
+        outside of it, so waiting workers are served in arrival order.
+        Returns the number of seconds spent waiting.
+        """
+        with self._lock:
+            now = time.monotonic()
+            paused = max(0, self._paused_until - now)
+            if not self._rate:
+                wait = paused
+            else:
+                self._refill(now)
+                self._tokens -= 1
+                wait = max(paused, -self._tokens / self._rate)
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class AdaptiveLimiter(TokenBucket):
+    """
+    Token bucket whose rate follows the health of the server (AIMD).
+
+    The rate grows by `increase` requests per second (a tenth of the initial
+    rate by default) after every fast successful response, up to
+    `max_rate`, and is multiplied by `decrease` after a throttled, failed or
+    timed out request, down to `min_rate`. Failures of requests sent
+    together count once: the rate is not decreased again until a request
+    interval has passed. A response is fast when its latency is within
+    `slow` times the lowest average latency seen so far; slow responses
+    leave the rate as it is, so the rate settles just below what the server
+    handles without trouble.
+    """
+    def __init__(self, rate, min_rate, max_rate, capacity=1, increase=None, decrease=0.5, slow=2.0):
+        super().__init__(rate, capacity=capacity)
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._increase = increase if increase is not None else rate / 10.0
+        self._decrease = decrease
+        self._decreased = 0
+        self._slow = slow
+        self._latency = None  # moving average
+        self._best = None  # lowest moving average seen
+
+    @classmethod
+    def from_tbr(cls, tbr, min_tbr, max_tbr=60, capacity=1):
+        """
+        Build a limiter starting at one request every `tbr` seconds that may
+        go as fast as one every `min_tbr` and as slow as one every `max_tbr`.
+        """
+        if not tbr or tbr <= 0:
+            raise Exception("Adaptive rate limiting needs a time between requests.")
+        if not min_tbr or min_tbr <= 0 or min_tbr > tbr:
+            raise Exception("Minimum time between requests [{}] must be between 0 and {}.".format(min_tbr, tbr))
+        max_tbr = max(max_tbr, tbr)
+        return cls(rate=1.0 / tbr, min_rate=1.0 / max_tbr, max_rate=1.0 / min_tbr, capacity=capacity)
+
+    def __set_rate(self, rate):
+        # tokens earned so far are kept at the old rate
+        self._refill(time.monotonic())
+        self._rate = min(self._max_rate, max(self._min_rate, rate))
+
+    def success(self, latency):
+        with self._lock:
+            self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+            self._best = self._latency if self._best is None else min(self._best, self._latency)
+            if latency <= self._slow * self._best:
+                self.__set_rate(self._rate + self._increase)
+
+    def failure(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._decreased >= 1.0 / self._rate:
+                self._decreased = now
+                self.__set_rate(self._rate * self._decrease)
+        super().failure(retry_after)
+
+
+class Backoff:
+    """
+    Exponential backoff with full jitter: the n-th retry waits a random time
+    between 0 and min(cap, base * 2 ** n) seconds, so that workers failing
+    together do not retry together.
+    """
+    def __init__(self, base=1, cap=60):
+        self._base = base
+        self._cap = cap
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self._cap, self._base * 2 ** attempt))
+
+
+def retry_after(value):
+    """
+    Seconds to wait according to a Retry-After header, given either as a
+    number of seconds or as an HTTP date. None when missing or invalid.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        from email.utils import parsedate_to_datetime
+
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if date is None:
+            return None
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        seconds = (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    return min(MAX_RETRY_AFTER, max(0.0, seconds))
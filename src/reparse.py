@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+
+from multiprocessing import Pool
+from urllib.parse import urlparse, parse_qs
+
+from archive import read_record
+from incident import Incident
+import parsers
+from writers import AtomicFile, ColumnarWriter, CsvWriter, split_compression
+
+
+PRE_2016_PATH = re.compile(r'/reports/mass-shootings/(\d{4})/?$')
+
+
+def listing_page(url):
+    """
+    (year, page) of a listing page URL, None for any other URL.
+    """
+    p = urlparse(url)
+    q = parse_qs(p.query)
+    m = PRE_2016_PATH.search(p.path)
+    if m:
+        year = int(m.group(1))
+    elif p.path.rstrip('/').endswith('/reports/mass-shooting') and 'year' in q:
+        year = int(q['year'][0])
+    else:
+        return None
+    return year, int(q.get('page', ['0'])[0])
+
+
+def _parse_record(task):
+    filename, offset, length, backend = task
+    return parsers.parse_incident(backend, read_record(filename, offset, length))
+
+
+class Reparser:
+    """
+    Rebuild the output from the raw pages of an archive, without network.
+
+    Listing pages give the incidents and their order, incident pages are
+    read and parsed by a pool of processes, each one reading its records
+    straight from the archive file.
+    """
+    def __init__(self, archive, logger, parser='auto', processes=None, years=None):
+        self._archive = archive
+        self._logger = logger
+        self._parser = parsers.get_parser(parser)
+        self._processes = processes or os.cpu_count() or 1
+        self._years = set(years) if years else None
+
+    def __incidents(self):
+        pages = []
+        for url in self._archive.urls():
+            page = listing_page(url)
+            if page is None or (self._years is not None and page[0] not in self._years):
+                continue
+            pages.append((-page[0], page[1], url))
+
+        seen = set()
+        incidents = []
+        for _, _, url in sorted(pages):
+            rows, _ = self._parser.parse_listing(self._archive.get(url))
+            for row in rows:
+                incident = Incident.from_listing_row(row, url)
+                if incident.incident_link in seen:
+                    continue
+                seen.add(incident.incident_link)
+                incidents.append(incident)
+        self._logger.info("%d incidents in %d archived listing pages", len(incidents), len(pages))
+        return incidents
+
+    def __fields(self, incidents):
+        tasks = []
+        for incident in incidents:
+            entry = self._archive.entry(incident.incident_link)
+            if entry is None:
+                self._logger.warning("%s is not archived. Skipping additional info.", incident.incident_link)
+                continue
+            tasks.append((incident, (self._archive.filename, entry['offset'], entry['length'], self._parser.name)))
+
+        if self._processes == 1:
+            results = map(_parse_record, [task for _, task in tasks])
+            for (incident, _), fields in zip(tasks, results):
+                yield incident, fields
+            return
+
+        with Pool(processes=self._processes) as pool:
+            results = pool.imap(_parse_record, [task for _, task in tasks], chunksize=16)
+            for (incident, _), fields in zip(tasks, results):
+                yield incident, fields
+
+    def run(self, filename, fmt='csv'):
+        incidents = self.__incidents()
+        for incident, fields in self.__fields(incidents):
+            for name, value in fields.items():
+                setattr(incident, name, value)
+
+        if fmt == 'csv':
+            with AtomicFile(filename, compression=split_compression(filename)[1]) as f:
+                writer = CsvWriter(f)
+                writer.write_header()
+                for incident in incidents:
+                    writer.write(incident)
+        else:
+            writer = ColumnarWriter(fmt, filename)
+            try:
+                for incident in incidents:
+                    writer.write(incident)
+            except BaseException:
+                writer.abort()
+                raise
+            writer.close()
+
+        self._logger.info("%d incidents written to %s", len(incidents), filename)
+        return len(incidents)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+Which incidents of the store are worth fetching again.
+
+Incidents change most in the days after they happen (victims die of their
+wounds, participants are identified) and hardly ever after a few months.
+Every incident of the store gets a revisit interval that grows with its
+age and shrinks with the number of changes seen so far, and is due once
+that interval has passed since it was last fetched (its last_seen). Each
+run takes the most overdue incidents, at most `budget` of them, so a
+daily refresh of the whole archive costs a bounded and predictable number
+of requests.
+"""
+
+import collections
+import heapq
+import time
+
+
+DAY = 24 * 60 * 60
+
+MIN_INTERVAL = 1  # days
+
+MAX_INTERVAL = 180  # days
+
+AGE_FACTOR = 0.1  # an incident n days old is revisited every n / 10 days
+
+FETCH_SIZE = 1000
+
+Due = collections.namedtuple('Due', ['incident_id', 'date', 'interval', 'overdue'])
+
+
+class RefreshScheduler:
+    """
+    Revisit intervals of the incidents of an IncidentStore, in days.
+    """
+    def __init__(self, store, now=None, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 age_factor=AGE_FACTOR):
+        self._store = store
+        self._now = time.time() if now is None else now
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._age_factor = age_factor
+        self._dates = {}
+
+    def interval(self, age, changes):
+        """
+        Days between two fetches of an incident `age` days old that changed
+        `changes` times since it was first stored.
+        """
+        interval = age * self._age_factor / (1 + changes)
+        return min(self._max_interval, max(self._min_interval, interval))
+
+    def __timestamp(self, date):
+        timestamp = self._dates.get(date)
+        if timestamp is None:
+            from dateutil.parser import parse
+
+            try:
+                timestamp = parse(date).timestamp()
+            except (TypeError, ValueError, OverflowError):
+                timestamp = self._now
+            self._dates[date] = timestamp
+        return timestamp
+
+    def __incidents(self):
+        """
+        Generator of (incident id, date, interval, days since last fetched).
+        """
+        cursor = self._store.connection.execute('SELECT incident_id, date, revision, last_seen FROM incidents')
+        try:
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                for incident_id, date, revision, last_seen in rows:
+                    age = max(0.0, (self._now - self.__timestamp(date)) / DAY)
+                    interval = self.interval(age, (revision or 1) - 1)
+                    yield incident_id, date, interval, (self._now - (last_seen or 0)) / DAY
+        finally:
+            cursor.close()
+
+    def due(self, budget):
+        """
+        The `budget` most overdue incidents, most overdue first. Only the
+        best `budget` are kept while the store is read.
+        """
+        heap = []
+        for incident_id, date, interval, elapsed in self.__incidents():
+            overdue = elapsed / interval
+            if overdue < 1:
+                continue
+            item = (overdue, -incident_id, date, interval)
+            if len(heap) < budget:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+        return [Due(-key, date, interval, overdue)
+                for overdue, key, date, interval in sorted(heap, reverse=True)]
+
+    def stats(self):
+        """
+        Number of incidents, of those due now, and requests a day it takes
+        to keep every incident within its interval.
+        """
+        incidents = due = 0
+        cost = 0.0
+        for _, _, interval, elapsed in self.__incidents():
+            incidents += 1
+            due += elapsed >= interval
+            cost += 1 / interval
+        return incidents, due, cost
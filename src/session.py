@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+from cache import CacheEntry, CacheMiss
+from logger import LOGGER
+from metrics import Registry
+from ratelimit import Backoff, retry_after
+
+
+class Response:
+    """
+    Minimal response returned by HttpSession.
+
+    A 304 (Not Modified) answer is turned into a response carrying the body
+    that was stored when the page was last downloaded, so callers never have
+    to care whether the page travelled over the wire or not.
+    """
+    def __init__(self, url, status_code, text, headers=None, not_modified=False, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+        self.not_modified = not_modified
+        self.from_cache = from_cache
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def __str__(self):
+        return "<Response [{}] {}>".format(self.status_code, self.url)
+    __repr__ = __str__
+
+
+class _MemoryStore:
+    """
+    Keeps validators and bodies for the lifetime of the session when no
+    on-disk cache is used. Entries are never fresh, they are only used to
+    revalidate.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def is_fresh(self, url, entry):
+        return False
+
+    def get(self, url):
+        with self._lock:
+            return self._entries.get(url)
+
+    def put(self, url, text, etag=None, last_modified=None):
+        if not etag and not last_modified:
+            return
+        with self._lock:
+            self._entries[url] = CacheEntry(text, etag, last_modified, 0)
+
+    def touch(self, url):
+        pass
+
+    def close(self):
+        pass
+
+
+class HttpSession:
+    """
+    Keep-alive HTTP session with a connection pool and conditional requests.
+
+    Responses are looked up in `cache` first (any object with the interface
+    of cache.ResponseCache) and only go to the network when missing or
+    stale. Stale entries are revalidated with If-None-Match/If-Modified-Since
+    so that the server can answer 304. The rate limiter is only consulted
+    for requests that actually hit the network, and in `offline` mode the
+    network is never used at all. When an `archive` is given every
+    successful response is recorded in it, wherever it came from.
+
+    Throttled (429), failed (5xx) and timed out requests are tried up to
+    `tries` times, waiting as long as the Retry-After header asks or else
+    with exponential backoff, and the limiter is told about every outcome
+    so that it can adapt its rate.
+
+    Latency, status codes, cache hits, retries and the time spent waiting
+    for the rate limiter are recorded in `metrics` (a metrics.Registry).
+    """
+    def __init__(self, user_agent, pool_size=10, timeout=60, limiter=None, cache=None, offline=False,
+                 archive=None, metrics=None, tries=3, backoff=None, logger=None):
+        self._timeout = timeout
+        self._limiter = limiter
+        self._tries = tries
+        self._backoff = backoff if backoff is not None else Backoff()
+        self._logger = logger if logger is not None else logging.getLogger(LOGGER)
+        self._cache = cache if cache is not None else _MemoryStore()
+        self._offline = offline
+        self._archive = archive
+        self._metrics = metrics if metrics is not None else Registry()
+        self._fetch_seconds = self._metrics.histogram(
+            'shootings_fetch_seconds', "Time to get a response from the network.")
+        self._wait_seconds = self._metrics.histogram(
+            'shootings_ratelimit_wait_seconds', "Time spent waiting for the rate limiter.")
+        self._responses = self._metrics.counter(
+            'shootings_responses_total', "Responses received from the network by status code.", ['status'])
+        self._errors = self._metrics.counter(
+            'shootings_request_errors_total', "Requests that failed without a response.", ['error'])
+        self._cache_hits = self._metrics.counter(
+            'shootings_cache_hits_total', "Responses served from the cache without a request.")
+        self._retries = self._metrics.counter(
+            'shootings_retries_total', "Requests tried again by reason.", ['reason'])
+        self._rate = self._metrics.gauge(
+            'shootings_request_rate', "Requests per second allowed by the rate limiter (0 is unlimited).")
+        if limiter is not None:
+            self._rate.set(limiter.rate or 0)
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._session.headers.update({
+            'user-agent': user_agent,
+            'accept-encoding': 'gzip, deflate',
+        })
+
+    def get(self, url):
+        attempt = 1
+        while True:
+            try:
+                r = self.__get(url)
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                reason, wait, error = type(ex).__name__, None, ex
+            else:
+                if r.status_code != 429 and r.status_code < 500:
+                    break
+                reason, wait, error = str(r.status_code), retry_after(r.headers.get('retry-after')), None
+
+            if self._limiter is not None:
+                self._limiter.failure(wait)
+                self._rate.set(self._limiter.rate or 0)
+            if attempt >= self._tries:
+                if error is not None:
+                    raise error
+                break
+
+            if wait is None:
+                wait = self._backoff.delay(attempt)
+            elif self._limiter is not None:
+                # the limiter already holds every worker for that long
+                wait = 0
+            self._retries.inc(reason)
+            self._logger.warning("Could not fetch url %s (%s). Retrying in %.1f seconds.", url, reason, wait)
+            time.sleep(wait)
+            attempt += 1
+
+        if self._archive is not None and r.ok:
+            self._archive.append(url, r.text, r.status_code)
+        return r
+
+    def __get(self, url):
+        entry = self._cache.get(url)
+        if entry is not None and (self._offline or self._cache.is_fresh(url, entry)):
+            self._cache_hits.inc()
+            return Response(url, 200, entry.text, from_cache=True)
+
+        if self._offline:
+            raise CacheMiss("URL not in cache: {}".format(url))
+
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['if-none-match'] = entry.etag
+            if entry.last_modified:
+                headers['if-modified-since'] = entry.last_modified
+
+        if self._limiter is not None:
+            self._wait_seconds.observe(self._limiter.acquire())
+        start = time.perf_counter()
+        try:
+            r = self._session.get(url, headers=headers, timeout=self._timeout)
+        except requests.RequestException as ex:
+            self._errors.inc(type(ex).__name__)
+            raise
+        finally:
+            self._fetch_seconds.observe(time.perf_counter() - start)
+        self._responses.inc(str(r.status_code))
+        if self._limiter is not None and r.status_code != 429 and r.status_code < 500:
+            self._limiter.success(r.elapsed.total_seconds())
+            self._rate.set(self._limiter.rate or 0)
+
+        if r.status_code == 304 and entry is not None:
+            self._cache.touch(url)
+            return Response(url, r.status_code, entry.text, r.headers, not_modified=True)
+
+        if r.ok:
+            self._cache.put(url, r.text, r.headers.get('etag'), r.headers.get('last-modified'))
+
+        return Response(url, r.status_code, r.text, r.headers)
+
+    def close(self):
+        self._session.close()
+        self._cache.close()
+        if self._archive is not None:
+            self._archive.close()
@@ -3,23 +3,39 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import collections
 import csv
 import datetime
 import logging
 import os
-import re
+import sys
+import threading
 import time
 
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin, urlparse, parse_qs
 
-import requests
-
-from bs4 import BeautifulSoup
-from dateutil.parser import parse
-
+# requests, dateutil and whatever else is costly to import are imported where
+# they are used, so that -c, -w and the commands run from scripts (query
+# above all) start fast.
+from analytics import KEYS
+from archive import Archive
+from cache import CacheMiss, ResponseCache
+from checkpoint import Checkpoint
+import diff
 from incident import Incident
 import license
 import logger
+from metrics import MetricsExporter, Registry
+from orchestrator import MultiYearCrawl, parse_years, year_output
+from parsers import get_parser, timed_parse_incident
+from pipeline import Pipeline
+import query
+from ratelimit import AdaptiveLimiter, TokenBucket
+from store import IncidentStore, to_incident
+import workqueue
+from writers import (COMPRESSIONS, FORMATS, PART, AtomicFile, ColumnarWriter, CsvWriter, RotatingFile, parse_size,
+                     split_compression)
 
 
 BASE_URL = 'http://www.gunviolencearchive.org'
@@ -28,56 +44,205 @@ REPORTS = 'reports/mass-shooting?year=<year>'
 PAGE_ARG_PRE_2016 = '?page=<num_page>'
 PAGE_ARG = '&page=<num_page>'
 
+CACHE_FILE = os.path.join('..', 'cache', 'responses.sqlite')
+CHECKPOINT_EVERY = 25  # incidents written between checkpoints
+PROGRESS_EVERY = 100  # incidents written between progress reports
+STORE_BATCH = 100  # incidents upserted into the store per transaction
+QUEUE_SIZE = 100  # items waiting between two stages of the pipeline
+REFRESH_BUDGET = 500  # incidents fetched by a refresh
+COORDINATOR_EVERY = 5  # seconds between progress reports of the coordinator
+
 VERSION = '0.0.1'
 USER_AGENT = 'shootings/{}'.format(VERSION)
 
 
+def check_year(year):
+    current_year = datetime.datetime.now().year
+    if year < 2013 or year > current_year:
+        raise Exception("Year [{}] must be between 2013 and {}.".format(year, current_year))
+    return year
+
+
+def output_filename(name=None, fmt='csv', formats=FORMATS, compression=None):
+    ext = formats[fmt]
+    if compression is not None:
+        if name:
+            name, _ = split_compression(name)
+        return output_filename(name, fmt, formats) + COMPRESSIONS[compression]
+    if not name:
+        return 'output{}'.format(ext)
+    if name.endswith(ext):
+        return name
+    return "{}{}".format(name, ext)
+
+
+def create_session(args=None, metrics=None):
+    """
+    Build the HTTP session, rate limiter and response cache included, from
+    the command line arguments. A session can be shared by several crawlers,
+    which then share the same request budget and cache.
+    """
+    tbr = 10
+    min_tbr = None
+    tries = 3
+    pool_size = 10
+    offline = False
+    cache_file = CACHE_FILE
+    archive = None
+
+    if args is not None:
+        if args.tbr is not None:
+            if args.tbr < 0:
+                raise Exception("Time between requests [{}] must not be negative.".format(args.tbr))
+            tbr = args.tbr
+        min_tbr = args.min_tbr
+
+        if args.tries:
+            if args.tries < 1:
+                raise Exception("Number of tries [{}] must be at least 1.".format(args.tries))
+            tries = args.tries
+
+        if args.pool_size:
+            pool_size = args.pool_size
+        elif args.workers:
+            pool_size = max(10, args.workers)
+
+        offline = args.offline
+        if args.no_cache:
+            if offline:
+                raise Exception("Offline mode needs the response cache.")
+            cache_file = None
+        elif args.cache:
+            cache_file = args.cache
+
+        if args.archive:
+            archive = Archive(args.archive)
+
+    if min_tbr is not None:
+        limiter = AdaptiveLimiter.from_tbr(tbr, min_tbr)
+    else:
+        limiter = TokenBucket.from_tbr(tbr)
+
+    cache = None
+    if cache_file is not None:
+        cache = ResponseCache(cache_file)
+
+    from session import HttpSession
+
+    return HttpSession(
+        user_agent=USER_AGENT,
+        pool_size=pool_size,
+        limiter=limiter,
+        cache=cache,
+        offline=offline,
+        archive=archive,
+        metrics=metrics,
+        tries=tries
+    )
+
+
 class ShootingsCrawler:
-    def __init__(self, args=None):
+    def __init__(self, args=None, year=None, output=None, session=None, progress=None, store=None, metrics=None):
         level = logging.INFO
         if args is not None and args.debug:
             level = logging.DEBUG
 
-        self._logger = logger.get_logger(level=level, maxbytes=1024 * 1024)
+        self._logger = logger.get_logger(level=level, maxbytes=1024 * 1024,
+                                         json_format=args is not None and args.log_json)
         self._logger.info('==========================================')
-        self._logger.debug('arguments: {}'.format(args))
+        self._logger.debug('arguments: %s', args)
 
         current_year = datetime.datetime.now().year
 
         if args is not None:
             if args.year:
-                year = args.year
-                if year >= 2013 and year <= current_year:
-                    self.year = year
-                else:
-                    raise Exception("Year [{}] must be between 2013 and {}.".format(args.year, current_year))
+                self.year = check_year(args.year)
             else:
                 self.year = current_year
 
-            if args.tbr:
-                self._tbr = args.tbr
-            else:
-                self._tbr = 10
+            self._format = args.format or 'csv'
+            self._compression = args.compress
+            self._output = output_filename(args.output, self._format, compression=self._compression)
 
-            if args.tries:
-                self._tries = args.tries
+            self._rotate_year = args.rotate == 'year'
+            self._rotate_size = None
+            if args.rotate and not self._rotate_year:
+                self._rotate_size = parse_size(args.rotate)
+            if self._format != 'csv' and (self._compression or args.rotate):
+                raise Exception("Compression and rotation only work with CSV output.")
+
+            if args.workers:
+                if args.workers < 1:
+                    raise Exception("Number of workers [{}] must be at least 1.".format(args.workers))
+                self._workers = args.workers
             else:
-                self._tries = 3
+                self._workers = 1
 
-            if args.output:
-                if args.output.endswith('.csv'):
-                    self._output = args.output
-                else:
-                    self._output = "{}.csv".format(args.output)
+            if args.processes:
+                if args.processes < 0:
+                    raise Exception("Number of processes [{}] must not be negative.".format(args.processes))
+                self._processes = args.processes
             else:
-                self._output = 'output.csv'
+                self._processes = 0
+
+            self._incremental = args.incremental
+            self._resume = args.resume
+            if self._format != 'csv' and (self._incremental or self._resume):
+                raise Exception("Incremental and resumed crawls only work with CSV output.")
+            if (self._compression or args.rotate) and (self._incremental or self._resume):
+                raise Exception("Incremental and resumed crawls do not work with compressed or rotated output.")
+            self._parser = get_parser(args.parser or 'auto')
         else:
             self.year = current_year
-            self._tbr = 10
-            self._tries = 3
+            self._format = 'csv'
+            self._compression = None
             self._output = 'output.csv'
+            self._rotate_year = False
+            self._rotate_size = None
+            self._workers = 1
+            self._processes = 0
+            self._incremental = False
+            self._resume = False
+            self._parser = get_parser()
+        self._logger.debug("Parser: %s", self._parser.name)
+
+        if year is not None:
+            self.year = check_year(year)
+        if output is not None:
+            self._output = output
+        elif self._rotate_year:
+            self._output = year_output(self._output, self.year)
 
-        self._last_request = 0
+        self._metrics = metrics if metrics is not None else Registry()
+        self._pages_total = self._metrics.counter('shootings_pages_total', "Listing pages fetched.")
+        self._incidents_total = self._metrics.counter('shootings_incidents_total', "Incidents written.")
+        self._planned_total = self._metrics.counter(
+            'shootings_incidents_planned_total', "Incidents found in the listing pages still to be crawled.")
+        self._skipped_total = self._metrics.counter(
+            'shootings_incidents_skipped_total', "Incidents written without their additional info.")
+        self._listing_seconds = self._metrics.histogram(
+            'shootings_listing_parse_seconds', "Time to parse a listing page.")
+        self._incident_seconds = self._metrics.histogram(
+            'shootings_incident_parse_seconds', "Time to parse an incident page.")
+        self._write_seconds = self._metrics.histogram(
+            'shootings_write_seconds', "Time to write an incident to the output.")
+        self._store_seconds = self._metrics.histogram(
+            'shootings_store_seconds', "Time to upsert a batch of incidents into the store.")
+
+        self._owns_session = session is None
+        if session is None:
+            session = create_session(args, metrics=self._metrics)
+        self._session = session
+        self._progress = progress
+
+        self._owns_store = store is None and args is not None and args.store is not None
+        if self._owns_store:
+            store = IncidentStore(args.store)
+        self._store = store
+        self._stored = []  # incidents waiting to be upserted into the store
+
+        self._process_pool = None
+        self._lock = threading.Lock()
         self.__create_base_url()
 
     def __create_base_url(self):
@@ -87,283 +252,863 @@ class ShootingsCrawler:
             base_url = urljoin(BASE_URL, REPORTS) + PAGE_ARG
 
         self._base_url = base_url.replace('<year>', str(self.year))
-        self._logger.debug("Base URL: {}".format(self._base_url))
+        self._logger.debug("Base URL: %s", self._base_url)
 
     def get_logger(self):
         return self._logger
 
-    def __get_num_pages(self, data):
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def session(self):
+        return self._session
+
+    @property
+    def output(self):
+        return self._output
+
+    def __get_num_pages(self, last):
         self._logger.debug("getting num of pages")
-        a = data.find('li', attrs={'class': 'pager-last'}).find('a')
-        url = urljoin(BASE_URL, a['href'])
+        if last is None:
+            self._logger.debug("No pager, a single page to fetch")
+            return 0
+        url = urljoin(BASE_URL, last)
         p = urlparse(url)
         q = parse_qs(p.query)
         pages = int(int(q['page'][0]))
-        self._logger.debug("# of pages to fetch: %d" % pages)
+        self._logger.debug("# of pages to fetch: %d", pages)
         return pages
 
     def __make_request(self, url):
         """
         Make a request with the given user-agent.
 
-        Takes care to honor time between requests.
+        Takes care to honor time between requests. The rate limiter is shared
+        by all the workers, so it holds no matter how many run concurrently.
+        Responses are served from the cache when fresh, connections are kept
+        alive and stale pages are requested conditionally.
         """
-        while True:
-            t = int(time.time())
-            if t - self._last_request >= self._tbr:
-                self._last_request = t
-                break
-            time.sleep(1)
-
-        headers = {'user-agent': USER_AGENT}
-        r = requests.get(url=url, headers=headers)
+        r = self._session.get(url)
+        if r.from_cache:
+            self._logger.debug("From cache: %s", url)
+        elif r.not_modified:
+            self._logger.debug("Not modified: %s", url)
         return r
 
-    def __make_soup(self, data, parser='html.parser'):
-        return BeautifulSoup(data, parser)
-
-    def __fetch_page(self, page=0, tries=3):
+    def __fetch_page(self, page=0):
         url = self._base_url.replace('<num_page>', str(page))
-        self._logger.debug('fetching page {}'.format(url))
-
-        if tries < 0:
-            raise Exception("Could not fetch the URL: {}".format(url))
+        self._logger.debug('fetching page %s', url)
 
+        # the session already tried again with backoff on failures
         r = self.__make_request(url)
         if not r.ok:
-            print("Could not fetch url {}. Response code: {}. Retrying in {} seconds.".format(
-                url,
-                r.status_code,
-                self._tbr
-            ))
-            self._logger.warning("Could not fetch url {}. Response code: {}. Retrying in {} seconds.".format(
-                url,
-                r.status_code,
-                self._tbr
-            ))
-            self.__fetch_page(page=page, tries=tries - 1)
-
-        return self.__make_soup(r.text)
-
-    def __get_lat_lon(self, data, incident):
-        self._logger.debug("getting lat and lon")
-        lat, lon = 0, 0
-        geo = data.find('span', text=re.compile('Geolocation*'))
-        if not geo:
-            self._logger.debug("No geolocation section here. Exiting function.")
-            return
+            raise Exception("Could not fetch the URL: {}. Response code: {}.".format(url, r.status_code))
 
-        if geo:
-            geo = geo.text.split(':')[1].strip().replace(' ', '')
-            lat, lon = geo.split(',')
-        self._logger.debug("lat: {}".format(lat))
-        self._logger.debug("lon: {}".format(lon))
-        incident.lat = lat
-        incident.lon = lon
-
-    def __get_participants(self, data, incident):
-        self._logger.debug("getting participants")
-        participants = data.find('h2', text=re.compile('Participants*'))
-        if not participants:
-            self._logger.debug("No participants section here. Exiting function.")
-            return
+        self._pages_total.inc()
+        with self._listing_seconds.time():
+            return self._parser.parse_listing(r.text)
 
-        list_of_participants = []
-        uls = participants.parent.find_all('ul')
-        for ul in uls:
-            kvs = {}
-            lis = ul.find_all('li')
-            for li in lis:
-                t = li.text
-                if not t or ':' not in t:
-                    self._logger.debug("No value to get from participants: '{}'".format(t))
-                    continue
-                k, v = t.strip().split(':')
-                kvs[k.strip()] = v.strip()
-            list_of_participants.append(kvs)
-        self._logger.debug("Participants: {}".format(repr(list_of_participants)))
-        incident.participants = list_of_participants
-
-    def __get_characteristics(self, data, incident):
-        self._logger.debug("getting characteristics")
-        incident_characteristics = data.find('h2', text=re.compile('Incident Characteristics*'))
-        if not incident_characteristics:
-            self._logger.debug("No incident characteristics section here. Exiting function.")
-            return
-        list_of_characteristics = []
-        ul = incident_characteristics.parent.find('ul')
-        lis = ul.find_all('li')
-        for li in lis:
-            t = li.text
-            if not t:
-                self._logger.debug("No value to get from characteristics: '{}'".format(t))
-                continue
-            k = t.strip()
-            list_of_characteristics.append(k)
-        self._logger.debug("Characteristics: {}".format(repr(list_of_characteristics)))
-        incident.characteristics = list_of_characteristics
-
-    def __get_notes(self, data, incident):
-        self._logger.debug("getting notes")
-        notes = data.find('h2', text=re.compile('Notes*'))
-
-        if not notes:
-            self._logger.debug("No notes section here. Exiting function.")
-            return
+    def __apply(self, incident, fields):
+        self._logger.debug("Additional info of %s: %r", incident.incident_link, fields)
+        for name, value in fields.items():
+            setattr(incident, name, value)
 
-        detail = notes.parent.find('p')
-        if detail:
-            t = detail.text
-            if not t:
-                self._logger.debug("No notes: '{}'".format(t))
-                return
-            detail = t.strip()
-        self._logger.debug("Notes: {}".format(detail))
-        incident.notes = detail
-
-    def __get_guns_involved(self, data, incident):
-        self._logger.debug("getting guns involved")
-        guns = data.find('h2', text=re.compile('Guns Involved*'))
-
-        if not guns:
-            self._logger.debug("No guns involved section here. Exiting function.")
-            return
+    def __get_incident_page(self, incident):
+        """
+        HTML of the incident page, None when it can not be had even after
+        the retries of the session: the incident is kept without its
+        additional info rather than stopping the crawl.
+        """
+        from requests import RequestException
 
-        list_of_guns_involved = []
-        uls = guns.parent.find_all('ul')
-        for ul in uls:
-            kvs = {}
-            lis = ul.find_all('li')
-            for li in lis:
-                t = li.text
-                if not t or ':' not in t:
-                    self._logger.debug("No value to get from guns involved: '{}'".format(t))
-                    continue
-                k, v = t.strip().split(':')
-                kvs[k.strip()] = v.strip()
-            list_of_guns_involved.append(kvs)
-        self._logger.debug("Guns involved: {}".format(repr(list_of_guns_involved)))
-        incident.guns_involved = list_of_guns_involved
-
-    def __get_district(self, data, incident):
-        self._logger.debug("getting district")
-        district = data.find('h2', text=re.compile('District*'))
-
-        if not district:
-            self._logger.debug("No district section here. Exiting function.")
-            return
+        try:
+            r = self.__make_request(incident.incident_link)
+        except (CacheMiss, RequestException) as ex:
+            self._logger.warning("%s. Skipping additional info.", ex)
+            self._skipped_total.inc()
+            return None
+        if not r.ok:
+            self._logger.warning("Could not fetch url %s. Response code: %d. Skipping additional info.",
+                                 incident.incident_link, r.status_code)
+            self._skipped_total.inc()
+            return None
+        return r.text
 
-        district_data = {}
-        for t in district.parent.text.replace('\nDistrict\n', '').split('\n'):
-            if not t or ':' not in t:
-                self._logger.debug("No value to get from district: '{}'".format(t))
-                continue
-            k, v = t.strip().split(':')
-            district_data[k.strip()] = v.strip()
-        self._logger.debug("district: {}".format(repr(district_data)))
-        incident.district = district_data
+    def __fetch_incident_page(self, item):
+        page, incident = item
+        return page, incident, self.__get_incident_page(incident)
+
+    def __parse_incident_page(self, item):
+        """
+        Parse stage. With a process pool it only submits the page: the write
+        stage waits for the fields, while the pages behind it keep every
+        process busy.
+        """
+        page, incident, html = item
+        if html is None:
+            return page, incident, None
+        if self._process_pool is not None:
+            return page, incident, self._process_pool.submit(timed_parse_incident, self._parser.name, html)
+        with self._incident_seconds.time():
+            self.__apply(incident, self._parser.parse_incident(html))
+        return page, incident, None
 
     def __fetch_additional_info(self, incident):
-        r = self.__make_request(incident.incident_link)
-        data = self.__make_soup(r.text)
-        self.__get_lat_lon(data=data, incident=incident)
-        self.__get_participants(data=data, incident=incident)
-        self.__get_characteristics(data=data, incident=incident)
-        self.__get_notes(data=data, incident=incident)
-        self.__get_guns_involved(data=data, incident=incident)
-        self.__get_district(data=data, incident=incident)
+        """
+        Complete an incident with the details of its page. Returns whether
+        the page could be fetched.
+        """
+        html = self.__get_incident_page(incident)
+        if html is None:
+            return False
+        with self._incident_seconds.time():
+            self.__apply(incident, self._parser.parse_incident(html))
+        return True
     additional_info = __fetch_additional_info
 
-    def __extract_data(self, data):
-        self._logger.debug("extracting data")
-        rows = data.find_all('tbody')[0].find_all('tr')
+    def listing_page(self, page):
+        """
+        (rows, number of the last page) of a listing page of the year. Rows
+        are turned into incidents with Incident.from_listing_row().
+        """
+        rows, last = self.__fetch_page(page=page)
+        return rows, self.__get_num_pages(last)
+
+    def refresh(self, incidents):
+        """
+        Fetch again the pages of incidents already in the store, `workers`
+        at a time, and upsert them so that their changes are recorded.
+        Incidents whose page can not be fetched are left untouched and stay
+        due. Returns the number of incidents refreshed and changed.
+        """
+        if self._store is None:
+            raise Exception("Refreshing incidents needs a store.")
+        refreshed = changed = 0
+        batch = []
+        try:
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                for incident, ok in zip(incidents, executor.map(self.__fetch_additional_info, incidents)):
+                    if not ok:
+                        continue
+                    refreshed += 1
+                    batch.append(incident)
+                    if len(batch) >= STORE_BATCH:
+                        with self._store_seconds.time():
+                            changed += self._store.upsert_many(batch)
+                        batch = []
+            if batch:
+                with self._store_seconds.time():
+                    changed += self._store.upsert_many(batch)
+        finally:
+            if self._owns_session:
+                self._session.close()
+            if self._owns_store:
+                self._store.close()
+        self._logger.info("%d incidents refreshed, %d changed", refreshed, changed)
+        return refreshed, changed
 
+    def __extract_data(self, rows):
+        self._logger.debug("extracting data")
         incidents = []
 
         for row in rows:
-            incident = Incident()
-            columns = row.find_all('td')
-            date = parse(columns[0].text)
-            incident.year = date.year
-            incident.month = date.month
-            incident.day = date.day
-            incident.state = columns[1].text
-            incident.city_or_county = columns[2].text
-            incident.address = columns[3].text
-            incident.num_killed = columns[4].text
-            incident.num_injured = columns[5].text
-            incident_link = columns[6].find('ul').find('li').find('a')['href']  # link to incident
-            incident.incident_link = urljoin(BASE_URL, incident_link)
-
-            self.__fetch_additional_info(incident)
-
-            incidents.append(incident)
+            incidents.append(Incident.from_listing_row(row, BASE_URL))
 
         return incidents
 
     def run(self):
         self._logger.debug('running')
+        try:
+            if self._processes:
+                self._logger.debug('parsing in %d processes', self._processes)
+                from concurrent.futures import ProcessPoolExecutor
+
+                with ProcessPoolExecutor(max_workers=self._processes) as pool:
+                    self._process_pool = pool
+                    try:
+                        self.__run()
+                    finally:
+                        self._process_pool = None
+            else:
+                self.__run()
+        finally:
+            if self._owns_session:
+                self._session.close()
+            if self._owns_store:
+                self._store.close()
+
+    def __load_known(self, filename):
+        """
+        Incident links already present in a previous output file.
+        """
+        known = set()
+        with open(filename) as f:
+            for row in csv.DictReader(f):
+                known.add(row['incident_link'])
+        self._logger.info("%d known incidents in %s", len(known), filename)
+        return known
+
+    def __open_output(self, filename, checkpoint):
+        """
+        Open the output file, resuming from the checkpoint when asked to.
+
+        The output is written to a part file renamed once the crawl is over.
+        On resume the part file is truncated to the size recorded by the last
+        checkpoint, dropping any row written after it.
+        """
+        if self._resume and checkpoint.exists() and os.path.exists(PART.format(filename)):
+            checkpoint.load()
+            if checkpoint.year != self.year:
+                raise Exception("Checkpoint is for year {} but year {} was asked.".format(checkpoint.year, self.year))
+            self._logger.info("Resuming: %d pages and %d incidents already done",
+                              len(checkpoint.pages), len(checkpoint.incidents))
+            return AtomicFile(filename, resume_at=checkpoint.offset)
+
+        if self._incremental and os.path.exists(filename):
+            f = AtomicFile(filename, append=True)
+        else:
+            f = AtomicFile(filename)
+            CsvWriter(f).write_header()
+        checkpoint.reset(year=self.year, offset=f.tell())
+        checkpoint.save()
+        return f
+
+    def __discover(self, known, checkpoint):
+        """
+        Fetch the listing pages of the year and build the worklist of
+        (page, incident) still to be crawled, in listing order and without
+        duplicates, before any incident page is requested.
+
+        Up to `workers` pages are fetched at a time within the budget of the
+        rate limiter, and handled in page order as they arrive. In
+        incremental mode the walk stops at the first page that only holds
+        known incidents: the listing is ordered newest first, so everything
+        after it has been crawled already. Pages are then fetched one at a
+        time, so that none is requested past that page.
+        """
+        rows, last = self.__fetch_page(page=0)
+        self._pages = pages = self.__get_num_pages(last)
+
+        todo = collections.deque(i for i in range(0, pages + 1) if i not in checkpoint.pages)
+        self._logger.debug("%d pages already done", pages + 1 - len(todo))
+
+        worklist = []
+        seen = set(checkpoint.incidents)
+        fetching = collections.deque()  # (page, future) in page order
+        window = 1 if known else self._workers
+
+        def fetch(i):
+            return rows if i == 0 else self.__fetch_page(page=i)[0]
+
+        with ThreadPoolExecutor(max_workers=window) as executor:
+            while todo or fetching:
+                while todo and len(fetching) < window:
+                    i = todo.popleft()
+                    fetching.append((i, executor.submit(fetch, i)))
+                i, future = fetching.popleft()
+                incidents = self.__extract_data(future.result())
+                if known:
+                    incidents = [incident for incident in incidents if incident.incident_link not in known]
+                    if not incidents:
+                        self._logger.info("Page %d holds only known incidents. Stopping.", i)
+                        return worklist
+
+                # new incidents shift older ones to later pages, both
+                # between runs and while the listing is being walked
+                kept = []
+                for incident in incidents:
+                    key = incident.incident_id if incident.incident_id is not None else incident.incident_link
+                    if key not in seen:
+                        seen.add(key)
+                        kept.append(incident)
+
+                with self._lock:
+                    self._pending[i] = len(kept)
+                    if not kept:
+                        self._finished.append(i)
+                worklist.extend((i, incident) for incident in kept)
+
+        return worklist
+
+    def __list_incidents(self, known, checkpoint):
+        """
+        Listing stage: discover every incident still to be crawled, then
+        yield them as (page, incident).
+        """
+        worklist = self.__discover(known, checkpoint)
+        self._total = len(worklist)
+        self._planned_total.inc(amount=self._total)
+        self._started = time.monotonic()
+        self._logger.info("%d incidents to crawl in %d listing pages", self._total, len(self._pending))
+        for item in worklist:
+            yield item
+
+    def __report_progress(self):
+        done = self._written
+        elapsed = time.monotonic() - self._started
+        rate = done / elapsed if elapsed > 0 else 0
+        eta = (self._total - done) / rate if rate > 0 else 0
+        message = "[{}] {}/{} incidents ({:.0%}), {:.1f} incidents/s, ETA {}".format(
+            self.year,
+            done,
+            self._total,
+            done / self._total if self._total else 1,
+            rate,
+            datetime.timedelta(seconds=int(eta))
+        )
+        self._logger.info(message)
+        if self._progress is None:
+            print(message)
+
+    def __flush_store(self):
+        if self._store is None or not self._stored:
+            return
+        with self._store_seconds.time():
+            changed = self._store.upsert_many(self._stored)
+        self._logger.debug("%d incidents stored, %d new or changed", len(self._stored), changed)
+        self._stored = []
+
+    def __save_checkpoint(self, f, checkpoint, force=False):
+        with self._lock:
+            finished, self._finished = self._finished, []
+        if len(self._stored) >= STORE_BATCH:
+            self.__flush_store()
+        if not finished and not force and len(self._unsaved) < CHECKPOINT_EVERY:
+            return
+
+        # incidents behind a checkpoint are skipped when resuming, so they
+        # must be in the store before it is saved
+        self.__flush_store()
+        if f is not None:
+            checkpoint.mark(finished, self._unsaved, f.sync())
+        self._unsaved = []
+        if self._progress is not None:
+            for page in sorted(finished):
+                self._progress(self.year, page, self._pages)
+
+    def __write(self, writer, f, checkpoint, item):
+        """
+        Write stage: called for every incident once it is parsed, in the
+        order of the worklist whatever order the pages were fetched in.
+        """
+        page, incident, parsing = item
+        if parsing is not None:
+            fields, seconds = parsing.result()
+            self._incident_seconds.observe(seconds)
+            self.__apply(incident, fields)
+        with self._write_seconds.time():
+            self._write_incidents(writer, [incident])
+        self._incidents_total.inc()
+        self._written += 1
+        if self._written % PROGRESS_EVERY == 0 or self._written == self._total:
+            self.__report_progress()
+        self._unsaved.append(incident.incident_id)
+        if self._store is not None:
+            self._stored.append(incident)
+        with self._lock:
+            self._pending[page] -= 1
+            if self._pending[page] == 0:
+                self._finished.append(page)
+        self.__save_checkpoint(f, checkpoint)
+
+    def __run(self):
         filename = os.path.join('..', 'out', self._output)
-        with open(filename, 'w') as f:
-            writer = csv.writer(f)
-            writer.writerow(
-                [
-                    'sha256',
-                    'year',
-                    'month',
-                    'day',
-                    'state',
-                    'city_or_county',
-                    'address',
-                    'num_killed',
-                    'num_injured',
-                    'incident_link',
-                    'latitude',
-                    'longitude',
-                    'participants',
-                    'characteristics',
-                    'notes',
-                    'guns_involved',
-                    'district'
-                ]
-            )
+        checkpoint = Checkpoint('{}.checkpoint'.format(filename))
+
+        known = set()
+        if self._incremental and os.path.exists(filename):
+            known = self.__load_known(filename)
+
+        self._pages = 0
+        self._total = 0  # incidents in the worklist
+        self._written = 0
+        self._pending = {}  # page -> incidents of the page not written yet
+        self._finished = []  # pages completely written since the last checkpoint
+        self._unsaved = []  # incidents written since the last checkpoint
+
+        pipeline = Pipeline(queue_size=QUEUE_SIZE)
+        pipeline.add_stage(self.__fetch_incident_page, workers=self._workers)
+        pipeline.add_stage(self.__parse_incident_page)
+
+        if self._format != 'csv':
+            # columnar files can not be appended to, so there is no checkpoint
+            writer = ColumnarWriter(self._format, filename)
+            try:
+                pipeline.run(
+                    self.__list_incidents(known, checkpoint),
+                    lambda item: self.__write(writer, None, checkpoint, item),
+                    ordered=True
+                )
+            except BaseException:
+                writer.abort()
+                raise
+            finally:
+                self.__flush_store()
+            writer.close()
+            return
+
+        if self._compression is not None or self._rotate_size is not None:
+            # neither can be truncated at a checkpoint, so there is none
+            if self._rotate_size is not None:
+                f = RotatingFile(filename, self._rotate_size, compression=self._compression)
+            else:
+                f = AtomicFile(filename, compression=self._compression)
+                CsvWriter(f).write_header()
+            with f:
+                writer = CsvWriter(f)
+                try:
+                    pipeline.run(
+                        self.__list_incidents(known, checkpoint),
+                        lambda item: self.__write(writer, None, checkpoint, item),
+                        ordered=True
+                    )
+                finally:
+                    self.__save_checkpoint(None, checkpoint, force=True)
+            return
 
-            data = self.__fetch_page(page=0)
-            pages = self.__get_num_pages(data)
-            incidents = self.__extract_data(data)
-            self._write_incidents(writer, incidents)
-            for i in range(1, pages + 1):
-                data = self.__fetch_page(page=i)
-                incidents = self.__extract_data(data)
-                self._write_incidents(writer, incidents)
+        with self.__open_output(filename, checkpoint) as f:
+            writer = CsvWriter(f)
+            try:
+                pipeline.run(
+                    self.__list_incidents(known, checkpoint),
+                    lambda item: self.__write(writer, f, checkpoint, item),
+                    ordered=True
+                )
+            finally:
+                self.__save_checkpoint(f, checkpoint, force=True)
 
-    def _write_incidents(self, csvwriter, incidents):
+        checkpoint.remove()
+
+    def _write_incidents(self, writer, incidents):
         for incident in incidents:
-            csvwriter.writerow(incident.to_csv())
+            writer.write(incident)
 
 
-if __name__ == '__main__':
+def create_parser():
+    """
+    Command line parser of the crawler and its subcommands.
+    """
     parser = argparse.ArgumentParser()
 
+    parser.add_argument("-a", "--archive", help="Append the raw pages downloaded to this archive file.")
     parser.add_argument("-c", "--conditions", help="Check out the conditions summary.",
                         action="store_true")
+    parser.add_argument("--cache", help="Response cache file (default is ../cache/responses.sqlite).")
     parser.add_argument("-D", "--debug", help="Sets logger to log debug events.", action="store_true")
+    parser.add_argument("-f", "--format", help="Output format: csv, parquet or arrow (default csv).",
+                        choices=sorted(FORMATS))
+    parser.add_argument("-i", "--incremental", help="Only fetch incidents missing from the output file "
+                                                    "and append them to it.", action="store_true")
+    parser.add_argument("-j", "--workers", help="Number of incidents fetched concurrently (default 1).", type=int)
+    parser.add_argument("--log-json", help="Write the log as JSON Lines instead of plain text.",
+                        action="store_true")
+    parser.add_argument("-m", "--metrics", help="Write the crawl metrics to this file, in the Prometheus "
+                                                "text format, every few seconds.")
+    parser.add_argument("--metrics-port", help="Serve the crawl metrics on http://127.0.0.1:PORT/metrics.",
+                        type=int)
+    parser.add_argument("--min-tbr", help="Adapt the rate to the server, starting at --tbr and going as fast "
+                                          "as one request every MIN_TBR seconds while it answers quickly.",
+                        type=float)
+    parser.add_argument("--no-cache", help="Do not use the response cache.", action="store_true")
+    parser.add_argument("--offline", help="Replay responses from the cache without using the network.",
+                        action="store_true")
     parser.add_argument("-o", "--output", help="Output filename (default is output.csv).")
-    parser.add_argument("-t", "--tbr", help="Time elapsed between requests in seconds (default 10).", type=int)
-    parser.add_argument("-T", "--tries", help="Number of times trying to fetch the page (default 3).", type=int)
+    parser.add_argument("-P", "--parser", help="HTML parser: auto, lxml, selectolax or soup "
+                                               "(default auto, the fastest one installed).")
+    parser.add_argument("--processes", help="Number of processes parsing incident pages "
+                                            "(default 0, parse in the crawler process).", type=int)
+    parser.add_argument("-p", "--pool-size", help="Number of HTTP connections kept alive "
+                                                  "(default 10 or the number of workers).", type=int)
+    parser.add_argument("-R", "--rotate", help="Split the CSV output in one file per year ('year') or in files "
+                                               "of about this size, e.g. 100M.")
+    parser.add_argument("-r", "--resume", help="Resume an interrupted crawl from its checkpoint.",
+                        action="store_true")
+    parser.add_argument("-s", "--store", help="Also upsert the incidents into this SQLite store, "
+                                              "keeping the history of their revisions.")
+    parser.add_argument("-t", "--tbr", help="Time elapsed between requests in seconds (default 10). "
+                                            "Fractions of a second are allowed.", type=float)
+    parser.add_argument("-T", "--tries", help="Number of times trying to fetch a page when the server fails, "
+                                              "throttles or times out (default 3).", type=int)
     parser.add_argument("-w", "--warranty", help="Check out the warranty summary.", action="store_true")
     parser.add_argument("-y", "--year", help="Year of the shootings. Must be on or over 2013.", type=int)
+    parser.add_argument("-Y", "--years", help="Years crawled concurrently and merged into the output, "
+                                              "e.g. 2013-2017 or 2014,2016.")
+    parser.add_argument("-z", "--compress", help="Compress the CSV output with gzip or zstd.",
+                        choices=sorted(COMPRESSIONS))
+
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    reparse = subparsers.add_parser('reparse', help="Rebuild the output from an archive, without network.")
+    reparse.add_argument("archive", help="Archive written with --archive.")
+    reparse.add_argument("-f", "--format", help="Output format: csv, parquet or arrow (default csv).",
+                         choices=sorted(FORMATS))
+    reparse.add_argument("-o", "--output", help="Output filename (default is output.csv).")
+    reparse.add_argument("-P", "--parser", help="HTML parser: auto, lxml, selectolax or soup (default auto).")
+    reparse.add_argument("--processes", help="Number of parsing processes (default one per CPU).", type=int)
+    reparse.add_argument("-Y", "--years", help="Only these years, e.g. 2013-2017 or 2014,2016.")
+
+    search = subparsers.add_parser('query', help="Export the incidents of a store matching some filters.")
+    search.add_argument("store", help="Store written with --store.")
+    search.add_argument("--characteristic", help="Incident characteristic, matched as a case insensitive prefix.")
+    search.add_argument("--city", help="City or county.")
+    search.add_argument("-f", "--format", help="Output format: csv or jsonl (default csv).",
+                        choices=sorted(query.FORMATS))
+    search.add_argument("--limit", help="Maximum number of incidents.", type=int)
+    search.add_argument("-m", "--month", help="Month of the incidents (1-12).", type=int)
+    search.add_argument("--max-injured", help="At most this number of injured.", type=int)
+    search.add_argument("--max-killed", help="At most this number of killed.", type=int)
+    search.add_argument("--min-injured", help="At least this number of injured.", type=int)
+    search.add_argument("--min-killed", help="At least this number of killed.", type=int)
+    search.add_argument("-o", "--output", help="Output filename (default is the standard output).")
+    search.add_argument("--plan", help="Show the query plan instead of running the query.", action="store_true")
+    search.add_argument("--since", help="Only incidents added or changed since this date, e.g. 2018-03-01.")
+    search.add_argument("--state", help="State of the incidents.")
+    search.add_argument("-Y", "--years", help="Years of the incidents, e.g. 2017 or 2013-2015,2017.")
+
+    coordinator = subparsers.add_parser('coordinator', help="Queue the years of a distributed crawl for the workers.")
+    coordinator.add_argument("queue", help="Work queue file, shared with the workers.")
+    coordinator.add_argument("--wait", help="Show the progress of the workers until the crawl is done.",
+                             action="store_true")
+    coordinator.add_argument("-Y", "--years", help="Years to crawl, e.g. 2013-2017 or 2014,2016.", required=True)
+
+    changes = subparsers.add_parser('diff', help="Changelog between two outputs of a crawl, as JSON Lines.")
+    changes.add_argument("old", help="Older output: csv (compressed or not), parquet or arrow.")
+    changes.add_argument("new", help="Newer output: csv (compressed or not), parquet or arrow.")
+    changes.add_argument("-o", "--output", help="Changelog filename (default is the standard output).")
+    changes.add_argument("--partitions", help="Number of partitions the outputs are split in, only one of them is "
+                                              "held in memory at a time (default {}).".format(diff.PARTITIONS),
+                         type=int, default=diff.PARTITIONS)
+    changes.add_argument("-z", "--compress", help="Compress the changelog with gzip or zstd.",
+                         choices=sorted(COMPRESSIONS))
+
+    geo = subparsers.add_parser('geo', help="Incidents of an output near a point or inside a box (needs numpy).")
+    geo.add_argument("input", help="Output written by a crawl: csv (compressed or not), parquet or arrow.")
+    geo.add_argument("--bbox", help="Box south,west,north,east in degrees, instead of --near.")
+    geo.add_argument("-k", "--nearest", help="The nearest incidents to --near, instead of those within --radius.",
+                     type=int)
+    geo.add_argument("--limit", help="Maximum number of incidents.", type=int)
+    geo.add_argument("--near", help="Point latitude,longitude in degrees, e.g. 29.76,-95.37.")
+    geo.add_argument("--radius", help="Kilometres around --near (default 25).", type=float, default=25)
 
-    args = parser.parse_args()
+    refresh = subparsers.add_parser('refresh', help="Fetch again the incidents of a store most likely to have "
+                                                     "changed.")
+    refresh.add_argument("store", help="Store written with --store.")
+    refresh.add_argument("-n", "--budget", help="Maximum number of incidents fetched (default {}).".format(
+        REFRESH_BUDGET), type=int, default=REFRESH_BUDGET)
+    refresh.add_argument("--plan", help="Show the incidents due instead of fetching them.", action="store_true")
+
+    worker = subparsers.add_parser('worker', help="Crawl the tasks of a work queue into the store given with -s.")
+    worker.add_argument("queue", help="Work queue file, shared with the coordinator.")
+    worker.add_argument("--lease", help="Seconds a task is leased for before another worker can take it "
+                                        "(default {}).".format(workqueue.LEASE), type=float, default=workqueue.LEASE)
+    worker.add_argument("--name", help="Name of the worker in the queue (default host-pid).")
+
+    stats = subparsers.add_parser('stats', help="Aggregate the incidents of an output (needs numpy).")
+    stats.add_argument("input", help="Output written by a crawl: csv (compressed or not), parquet or arrow.")
+    stats.add_argument("--ages", help="Participants by age range.", action="store_true")
+    stats.add_argument("--by", help="Keys to group by, comma separated, among: {} (default state).".format(
+        ', '.join(KEYS)), default='state')
+    stats.add_argument("--genders", help="Participants by gender.", action="store_true")
+    stats.add_argument("--rolling", help="Incidents over a rolling window of this number of days.", type=int)
+    stats.add_argument("--type", help="Type of the participants of --ages and --genders (default Victim).",
+                       default='Victim')
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = create_parser().parse_args()
+    log = logger.get_logger(level=logging.DEBUG if args.debug else logging.INFO, maxbytes=1024 * 1024,
+                            json_format=args.log_json)
 
     if args.warranty:
         license.show_warranty()
     elif args.conditions:
         license.show_contitions()
+    elif args.command == 'reparse':
+        try:
+            from reparse import Reparser
+
+            if not os.path.exists(args.archive):
+                raise Exception("Archive {} does not exist.".format(args.archive))
+            years = None
+            if args.years:
+                years = parse_years(args.years)
+            r = Reparser(Archive(args.archive), log,
+                         parser=args.parser or 'auto', processes=args.processes, years=years)
+            fmt = args.format or 'csv'
+            r.run(os.path.join('..', 'out', output_filename(args.output, fmt)), fmt=fmt)
+        except Exception as ex:
+            print("Error: {}".format(ex))
+            log.error("Error: %s", ex)
+    elif args.command == 'query':
+        try:
+            if not os.path.exists(args.store):
+                raise Exception("Store {} does not exist.".format(args.store))
+            since = None
+            if args.since:
+                from dateutil.parser import parse
+
+                since = parse(args.since).timestamp()
+            q = query.Query(
+                years=parse_years(args.years) if args.years else None,
+                month=args.month,
+                state=args.state,
+                city=args.city,
+                min_killed=args.min_killed,
+                max_killed=args.max_killed,
+                min_injured=args.min_injured,
+                max_injured=args.max_injured,
+                characteristic=args.characteristic,
+                since=since,
+                limit=args.limit
+            )
+            store = IncidentStore(args.store)
+            rows = q.rows(store)
+            try:
+                if args.plan:
+                    for line in q.plan(store):
+                        print(line)
+                elif args.output:
+                    fmt = args.format or 'csv'
+                    filename = os.path.join('..', 'out', output_filename(args.output, fmt, query.FORMATS))
+                    with open(filename, 'w', newline='') as f:
+                        written = query.export(rows, f, fmt)
+                    print("{} incidents written to {}".format(written, filename))
+                else:
+                    try:
+                        query.export(rows, sys.stdout, args.format or 'csv')
+                        sys.stdout.flush()
+                    except BrokenPipeError:
+                        # output piped into head and the like
+                        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            finally:
+                rows.close()
+                store.close()
+        except Exception as ex:
+            print("Error: {}".format(ex))
+            log.error("Error: %s", ex)
+    elif args.command == 'coordinator':
+        try:
+            years = [check_year(year) for year in parse_years(args.years)]
+            queue = workqueue.WorkQueue(args.queue)
+            try:
+                added = workqueue.seed(queue, years)
+                print("{} of {} years queued in {}".format(added, len(years), args.queue))
+                while args.wait:
+                    counts = queue.counts()
+                    message = ', '.join('{} {}/{} done{}'.format(
+                        kind,
+                        counts.get((kind, 'done'), 0),
+                        sum(count for (k, _), count in counts.items() if k == kind),
+                        ', {} failed'.format(counts[(kind, 'failed')]) if counts.get((kind, 'failed')) else ''
+                    ) for kind in ('listing', 'incident'))
+                    print(message)
+                    log.info(message)
+                    if not queue.unfinished():
+                        break
+                    time.sleep(COORDINATOR_EVERY)
+            finally:
+                queue.close()
+        except Exception as ex:
+            print("Error: {}".format(ex))
+            log.error("Error: %s", ex)
+    elif args.command == 'worker':
+        registry = Registry()
+        try:
+            if not os.path.exists(args.queue):
+                raise Exception("Queue {} does not exist. Start the coordinator first.".format(args.queue))
+            if not args.store:
+                raise Exception("Workers need a store (-s) to write the incidents to.")
+            queue = workqueue.WorkQueue(args.queue, lease=args.lease)
+            session = create_session(args, metrics=registry)
+            store = IncidentStore(args.store)
+            crawlers = {}
+            crawlers_lock = threading.Lock()
+
+            def crawler_for(year):
+                with crawlers_lock:
+                    if year not in crawlers:
+                        crawlers[year] = ShootingsCrawler(args=args, year=year, session=session, store=store,
+                                                          metrics=registry)
+                    return crawlers[year]
+
+            try:
+                tasks = workqueue.CrawlTasks(queue, crawler_for, store, BASE_URL)
+                w = workqueue.Worker(queue, tasks.handlers, owner=args.name, concurrency=args.workers or 1,
+                                     logger=log)
+                completed, failed = w.run()
+                print("{} tasks completed, {} failed".format(completed, failed))
+            finally:
+                session.close()
+                store.close()
+                queue.close()
+        except Exception as ex:
+            print("Error: {}".format(ex))
+            log.error("Error: %s", ex)
+        finally:
+            for line in registry.summary():
+                print(line)
+                log.info(line)
+    elif args.command == 'diff':
+        try:
+            for filename in (args.old, args.new):
+                if not os.path.exists(filename):
+                    raise Exception("Output {} does not exist.".format(filename))
+            if args.partitions < 1:
+                raise Exception("At least one partition is needed.")
+            start = time.perf_counter()
+            if args.output:
+                filename = os.path.join('..', 'out', output_filename(args.output, 'jsonl', query.FORMATS,
+                                                                     compression=args.compress))
+                with AtomicFile(filename, compression=args.compress) as f:
+                    counts = diff.diff(args.old, args.new, f, partitions=args.partitions)
+                print("Changelog written to {}".format(filename))
+            else:
+                try:
+                    counts = diff.diff(args.old, args.new, sys.stdout, partitions=args.partitions)
+                    sys.stdout.flush()
+                except BrokenPipeError:
+                    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                    counts = None
+            if counts is not None:
+                print("{added} added, {removed} removed, {modified} modified, {unchanged} unchanged, "
+                      "{without_id} without id".format(**counts), "in {:.1f} s".format(time.perf_counter() - start),
+                      file=sys.stderr)
+        except Exception as ex:
+            print("Error: {}".format(ex))
+            log.error("Error: %s", ex)
+    elif args.command == 'geo':
+        try:
+            from spatial import SpatialIndex, write_places
+
+            if not os.path.exists(args.input):
+                raise Exception("Input {} does not exist.".format(args.input))
+
+            def degrees(value, count, option):
+                try:
+                    values = [float(v) for v in value.split(',')]
+                except ValueError:
+                    values = []
+                if len(values) != count:
+                    raise Exception("{} needs {} comma separated numbers.".format(option, count))
+                return values
+
+            start = time.perf_counter()
+            index = SpatialIndex.for_dataset(args.input)
+            loaded = time.perf_counter()
+            if args.bbox:
+                ids, distances = index.bbox(*degrees(args.bbox, 4, '--bbox'))[:args.limit], None
+            elif args.near:
+                lat, lon = degrees(args.near, 2, '--near')
+                if args.nearest:
+                    ids, distances = index.nearest(lat, lon, args.nearest)
+                else:
+                    ids, distances = index.within(lat, lon, args.radius, args.limit)
+            else:
+                raise Exception("Use either --near or --bbox.")
+            try:
+                write_places(index, ids, distances, sys.stdout)
+                sys.stdout.flush()
+            except BrokenPipeError:
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            print("{} of {} incidents with coordinates, index loaded in {:.3f} s, searched in {:.3f} s".format(
+                len(ids), len(index), loaded - start, time.perf_counter() - loaded), file=sys.stderr)
+        except Exception as ex:
+            print("Error: {}".format(ex))
+            log.error("Error: %s", ex)
+    elif args.command == 'refresh':
+        try:
+            from scheduler import RefreshScheduler
+
+            if not os.path.exists(args.store):
+                raise Exception("Store {} does not exist.".format(args.store))
+            if args.budget < 1:
+                raise Exception("Budget [{}] must be at least 1.".format(args.budget))
+            store = IncidentStore(args.store)
+            try:
+                scheduler = RefreshScheduler(store)
+                due = scheduler.due(args.budget)
+                incidents, pending, cost = scheduler.stats()
+                message = "{} incidents in the store, {} due, {:.1f} requests a day keep them all up to date".format(
+                    incidents, pending, cost)
+                print(message)
+                log.info(message)
+                if args.plan:
+                    writer = csv.writer(sys.stdout)
+                    writer.writerow(['incident_id', 'date', 'interval_days', 'overdue'])
+                    for item in due:
+                        writer.writerow([item.incident_id, item.date, round(item.interval, 2), round(item.overdue, 2)])
+                else:
+                    crawler = ShootingsCrawler(args=args, store=store)
+                    refreshed, changed = crawler.refresh([to_incident(store.get(item.incident_id)) for item in due])
+                    print("{} of {} incidents refreshed, {} changed".format(refreshed, len(due), changed))
+            finally:
+                store.close()
+        except Exception as ex:
+            print("Error: {}".format(ex))
+            log.error("Error: %s", ex)
+    elif args.command == 'stats':
+        try:
+            from analytics import Dataset, write_aggregate, write_breakdown, write_series
+
+            if not os.path.exists(args.input):
+                raise Exception("Input {} does not exist.".format(args.input))
+            start = time.perf_counter()
+            dataset = Dataset.load(args.input)
+            loaded = time.perf_counter()
+            try:
+                if args.rolling:
+                    write_series(dataset.rolling(args.rolling), sys.stdout)
+                elif args.ages:
+                    write_breakdown(*dataset.age_breakdown(participant_type=args.type), sys.stdout, 'age')
+                elif args.genders:
+                    write_breakdown(*dataset.gender_breakdown(participant_type=args.type), sys.stdout, 'gender')
+                else:
+                    keys = [key.strip() for key in args.by.split(',')]
+                    write_aggregate(dataset.group_by(*keys), keys, sys.stdout)
+                sys.stdout.flush()
+            except BrokenPipeError:
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            print("{} incidents loaded in {:.3f} s, aggregated in {:.3f} s".format(
+                dataset.n, loaded - start, time.perf_counter() - loaded), file=sys.stderr)
+        except Exception as ex:
+            print("Error: {}".format(ex))
+            log.error("Error: %s", ex)
     else:
+        registry = Registry()
+        exporter = MetricsExporter(registry, filename=args.metrics, port=args.metrics_port)
         try:
-            r = ShootingsCrawler(args=args)
-            r.run()
+            exporter.start()
+            if args.years:
+                if args.year:
+                    raise Exception("Use either --year or --years, not both.")
+                years = [check_year(year) for year in parse_years(args.years)]
+                session = create_session(args, metrics=registry)
+                store = IncidentStore(args.store) if args.store else None
+
+                def crawler_factory(year, output, progress):
+                    return ShootingsCrawler(args=args, year=year, output=output, session=session, progress=progress,
+                                            store=store, metrics=registry)
+
+                try:
+                    fmt = args.format or 'csv'
+                    r = MultiYearCrawl(years, output_filename(args.output, fmt, compression=args.compress),
+                                       crawler_factory, fmt=fmt, merge=not args.rotate)
+                    r.run()
+                finally:
+                    session.close()
+                    if store is not None:
+                        store.close()
+            else:
+                r = ShootingsCrawler(args=args, metrics=registry)
+                r.run()
         except Exception as ex:
             print("Error: {}".format(ex))
-            logger.get_logger(maxbytes=1024 * 1024).error("Error: {}".format(ex))
+            log.error("Error: %s", ex)
+        finally:
+            exporter.stop()
+            for line in registry.summary():
+                print(line)
+                log.info(line)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+"""
+Spatial index over the coordinates of the incidents, computed with NumPy.
+
+Points are bucketed in a grid of cells of `cell` degrees and sorted by
+cell, row by row, so that the points of a run of cells in the same row are
+one contiguous slice found with np.searchsorted. A radius or bounding box
+query only measures the points of the cells it overlaps, and a nearest
+neighbour query widens its radius until it holds enough points.
+
+The index is saved with np.savez next to the dataset it was built from
+(2017.parquet -> 2017.parquet.geo.npz) and loaded from there as long as the
+dataset is not newer.
+"""
+
+import csv
+import math
+import os
+
+from analytics import Dataset, _numpy
+
+
+EARTH_RADIUS = 6371.0088  # km, mean radius
+
+CELL = 0.25  # degrees, about 28 km of latitude
+
+INDEX = '{}.geo.npz'
+
+
+def haversine(np, lat, lon, lats, lons):
+    """
+    Great circle distance in km from (lat, lon) to every point of the arrays.
+    """
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+class SpatialIndex:
+    """
+    Grid index over points given by their latitude and longitude. Points
+    with an unknown (NaN) coordinate are left out. Queries return the ids of
+    the points (their position in the arrays when no ids are given) and
+    their distance in km, nearest first.
+    """
+    def __init__(self, latitude, longitude, ids=None, cell=CELL):
+        np = _numpy()
+        self._np = np
+        self._cell = float(cell)
+        self._rows = int(math.ceil(180 / self._cell)) + 1
+        self._cols = int(math.ceil(360 / self._cell))
+
+        latitude = np.asarray(latitude, dtype=np.float64)
+        longitude = np.asarray(longitude, dtype=np.float64)
+        ids = np.arange(len(latitude)) if ids is None else np.asarray(ids, dtype=np.int64)
+        known = ~(np.isnan(latitude) | np.isnan(longitude))
+        keys = self.__keys(latitude[known], longitude[known])
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.latitude = latitude[known][order]
+        self.longitude = longitude[known][order]
+        self.ids = ids[known][order]
+        self._by_id = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __keys(self, lat, lon):
+        np = self._np
+        rows = np.clip(((lat + 90) // self._cell).astype(np.int64), 0, self._rows - 1)
+        cols = ((lon + 180) // self._cell).astype(np.int64) % self._cols
+        return rows * self._cols + cols
+
+    @classmethod
+    def from_dataset(cls, dataset, cell=CELL):
+        return cls(dataset.latitude, dataset.longitude, dataset.incident_id, cell)
+
+    @classmethod
+    def for_dataset(cls, filename, cell=CELL):
+        """
+        Index of the dataset in `filename`, loaded from its saved index when
+        it is up to date, or else built and saved.
+        """
+        index = INDEX.format(filename)
+        if os.path.exists(index) and os.path.getmtime(index) >= os.path.getmtime(filename):
+            loaded = cls.load(index)
+            if loaded._cell == cell:
+                return loaded
+        built = cls.from_dataset(Dataset.load(filename), cell)
+        built.save(index)
+        return built
+
+    def save(self, filename):
+        """
+        Save the index to `filename` atomically.
+        """
+        tmp = '{}.tmp'.format(filename)
+        with open(tmp, 'wb') as f:
+            self._np.savez(f, cell=self._cell, keys=self.keys, latitude=self.latitude, longitude=self.longitude,
+                           ids=self.ids)
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        np = _numpy()
+        with np.load(filename) as data:
+            index = cls.__new__(cls)
+            index._np = np
+            index._cell = float(data['cell'])
+            index._rows = int(math.ceil(180 / index._cell)) + 1
+            index._cols = int(math.ceil(360 / index._cell))
+            index.keys = data['keys']
+            index.latitude = data['latitude']
+            index.longitude = data['longitude']
+            index.ids = data['ids']
+            index._by_id = None
+        return index
+
+    def __candidates(self, first_row, last_row, col_ranges):
+        """
+        Positions of the points in the rows first_row..last_row and the
+        column ranges [(first, last)] given.
+        """
+        np = self._np
+        rows = np.arange(max(first_row, 0), min(last_row, self._rows - 1) + 1, dtype=np.int64)
+        starts, ends = [], []
+        for first, last in col_ranges:
+            starts.append(rows * self._cols + first)
+            ends.append(rows * self._cols + last + 1)
+        if not starts:
+            return np.zeros(0, dtype=np.int64)
+        starts = np.searchsorted(self.keys, np.concatenate(starts), side='left')
+        ends = np.searchsorted(self.keys, np.concatenate(ends), side='left')
+        lengths = ends - starts
+        if not lengths.sum():
+            return np.zeros(0, dtype=np.int64)
+        # positions start..end of every slice, without a Python loop
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(lengths.sum())
+
+    def __col_ranges(self, west, east):
+        """
+        Column ranges covering the longitudes west..east, which may cross the
+        antimeridian.
+        """
+        first = int((west + 180) // self._cell)
+        last = int((east + 180) // self._cell)
+        if last - first + 1 >= self._cols:
+            return [(0, self._cols - 1)]
+        first, last = first % self._cols, last % self._cols
+        if first <= last:
+            return [(first, last)]
+        return [(first, self._cols - 1), (0, last)]
+
+    def __result(self, positions, distances, limit=None):
+        np = self._np
+        order = np.argsort(distances, kind='stable')
+        if limit is not None:
+            order = order[:limit]
+        return self.ids[positions[order]], distances[order]
+
+    def within(self, lat, lon, km, limit=None):
+        """
+        (ids, distances) of the points at most `km` away from (lat, lon).
+        """
+        np = self._np
+        dlat = math.degrees(km / EARTH_RADIUS)
+        south, north = lat - dlat, lat + dlat
+        if south <= -90 or north >= 90:
+            col_ranges = self.__col_ranges(-180, 180)
+        else:
+            # widest longitude span of a circle not holding a pole
+            ratio = math.sin(km / EARTH_RADIUS) / math.cos(math.radians(lat))
+            dlon = math.degrees(math.asin(ratio)) if ratio < 1 else 180
+            col_ranges = self.__col_ranges(lon - dlon, lon + dlon)
+        positions = self.__candidates(int((south + 90) // self._cell), int((north + 90) // self._cell), col_ranges)
+        distances = haversine(np, lat, lon, self.latitude[positions], self.longitude[positions])
+        close = distances <= km
+        return self.__result(positions[close], distances[close], limit)
+
+    def bbox(self, south, west, north, east):
+        """
+        ids of the points inside the box, which crosses the antimeridian when
+        west > east.
+        """
+        np = self._np
+        if west > east:
+            col_ranges = self.__col_ranges(west, east + 360)
+        else:
+            col_ranges = self.__col_ranges(west, east)
+        positions = self.__candidates(int((south + 90) // self._cell), int((north + 90) // self._cell), col_ranges)
+        lats, lons = self.latitude[positions], self.longitude[positions]
+        inside = (lats >= south) & (lats <= north)
+        if west > east:
+            inside &= (lons >= west) | (lons <= east)
+        else:
+            inside &= (lons >= west) & (lons <= east)
+        return self.ids[positions[inside]]
+
+    def nearest(self, lat, lon, k=1):
+        """
+        (ids, distances) of the `k` points nearest to (lat, lon).
+        """
+        km = 111.2 * self._cell
+        k = min(k, len(self))
+        while True:
+            ids, distances = self.within(lat, lon, km, limit=k)
+            if len(ids) >= k or km >= math.pi * EARTH_RADIUS:
+                return ids, distances
+            km *= 2
+
+    def coordinates(self, ids):
+        """
+        (latitude, longitude) arrays of the points with the given ids.
+        """
+        np = self._np
+        if self._by_id is None:
+            self._by_id = np.argsort(self.ids, kind='stable')
+        positions = self._by_id[np.searchsorted(self.ids, ids, sorter=self._by_id)]
+        return self.latitude[positions], self.longitude[positions]
+
+
+def write_places(index, ids, distances, f):
+    """
+    Write the result of a query to the open file `f` as CSV, with the
+    distance in km when given.
+    """
+    writer = csv.writer(f)
+    lats, lons = index.coordinates(ids)
+    if distances is None:
+        writer.writerow(['incident_id', 'latitude', 'longitude'])
+        for row in zip(ids.tolist(), lats.tolist(), lons.tolist()):
+            writer.writerow(row)
+    else:
+        writer.writerow(['incident_id', 'latitude', 'longitude', 'distance_km'])
+        for row in zip(ids.tolist(), lats.tolist(), lons.tolist(), distances.round(3).tolist()):
+            writer.writerow(row)
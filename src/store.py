@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from incident import Incident
+
+COLUMNS = [
+    'incident_id', 'sha256', 'content_sha256', 'date', 'year', 'month', 'day', 'state', 'city_or_county',
+    'address', 'num_killed', 'num_injured', 'incident_link', 'latitude', 'longitude', 'participants',
+    'characteristics', 'notes', 'guns_involved', 'district',
+]
+
+# columns holding JSON documents
+NESTED = ['participants', 'characteristics', 'guns_involved', 'district']
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS incidents ('
+    '  incident_id INTEGER PRIMARY KEY,'
+    '  sha256 TEXT NOT NULL,'
+    '  content_sha256 TEXT NOT NULL,'
+    '  date TEXT NOT NULL,'
+    '  year INTEGER NOT NULL,'
+    '  month INTEGER NOT NULL,'
+    '  day INTEGER NOT NULL,'
+    '  state TEXT,'
+    '  city_or_county TEXT,'
+    '  address TEXT,'
+    '  num_killed INTEGER,'
+    '  num_injured INTEGER,'
+    '  incident_link TEXT NOT NULL,'
+    '  latitude REAL,'
+    '  longitude REAL,'
+    '  participants TEXT,'
+    '  characteristics TEXT,'
+    '  notes TEXT,'
+    '  guns_involved TEXT,'
+    '  district TEXT,'
+    '  revision INTEGER NOT NULL,'
+    '  first_seen REAL NOT NULL,'
+    '  last_seen REAL NOT NULL,'
+    '  updated_at REAL NOT NULL'
+    ')',
+    'CREATE INDEX IF NOT EXISTS incidents_date ON incidents (date)',
+    'CREATE INDEX IF NOT EXISTS incidents_state ON incidents (state, date)',
+    'CREATE INDEX IF NOT EXISTS incidents_city ON incidents (state, city_or_county, date)',
+    'CREATE INDEX IF NOT EXISTS incidents_updated_at ON incidents (updated_at)',
+    'CREATE TABLE IF NOT EXISTS revisions ('
+    '  incident_id INTEGER NOT NULL,'
+    '  revision INTEGER NOT NULL,'
+    '  content_sha256 TEXT NOT NULL,'
+    '  data TEXT NOT NULL,'
+    '  recorded_at REAL NOT NULL,'
+    '  PRIMARY KEY (incident_id, revision)'
+    ')',
+    'CREATE INDEX IF NOT EXISTS revisions_recorded_at ON revisions (recorded_at)',
+    'CREATE TABLE IF NOT EXISTS incident_characteristics ('
+    '  incident_id INTEGER NOT NULL,'
+    '  characteristic TEXT NOT NULL COLLATE NOCASE'
+    ')',
+    'CREATE INDEX IF NOT EXISTS incident_characteristics_characteristic '
+    'ON incident_characteristics (characteristic, incident_id)',
+    'CREATE INDEX IF NOT EXISTS incident_characteristics_incident_id ON incident_characteristics (incident_id)',
+]
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_row(incident):
+    """
+    Incident as a dictionary of store columns. Nested fields are JSON.
+    """
+    lat, lon = _float(incident.lat), _float(incident.lon)
+    if not lat and not lon:
+        lat = lon = None
+    year, month, day = _int(incident.year), _int(incident.month), _int(incident.day)
+
+    row = {
+        'incident_id': incident.incident_id,
+        'sha256': incident.sha256,
+        'date': '{:04d}-{:02d}-{:02d}'.format(year, month, day),
+        'year': year,
+        'month': month,
+        'day': day,
+        'state': incident.state,
+        'city_or_county': incident.city_or_county,
+        'address': incident.address,
+        'num_killed': _int(incident.num_killed),
+        'num_injured': _int(incident.num_injured),
+        'incident_link': incident.incident_link,
+        'latitude': lat,
+        'longitude': lon,
+        'participants': json.dumps(incident.participants, sort_keys=True),
+        'characteristics': json.dumps(incident.characteristics),
+        'notes': incident.notes,
+        'guns_involved': json.dumps(incident.guns_involved, sort_keys=True),
+        'district': json.dumps(incident.district, sort_keys=True),
+    }
+    # unlike Incident.sha256 this covers every field, details included
+    content = json.dumps([row[column] for column in COLUMNS if column not in ('sha256', 'content_sha256')])
+    row['content_sha256'] = hashlib.sha256(content.encode('utf_8')).hexdigest()
+    return row
+
+
+def to_incident(record):
+    """
+    Incident of a record returned by IncidentStore.get(), the inverse of
+    to_row().
+    """
+    incident = Incident(
+        year=record['year'],
+        month=record['month'],
+        day=record['day'],
+        state=record['state'],
+        city_or_county=record['city_or_county'],
+        address=record['address'],
+        num_killed=record['num_killed'],
+        num_injured=record['num_injured'],
+        incident_link=record['incident_link'],
+        lat=record['latitude'],
+        lon=record['longitude']
+    )
+    incident.participants = record['participants'] or []
+    incident.characteristics = record['characteristics'] or []
+    incident.notes = record['notes']
+    incident.guns_involved = record['guns_involved'] or []
+    incident.district = record['district'] or {}
+    return incident
+
+
+class IncidentStore:
+    """
+    Local SQLite store of incidents keyed by their numeric id.
+
+    Upserting an incident whose content changed keeps the new version in
+    `incidents` and appends it to `revisions`, so the whole history of every
+    incident is available. Indexes on date, state, city and update time keep
+    lookups and "what changed since" queries off full scans.
+    """
+    def __init__(self, filename):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+
+    @property
+    def connection(self):
+        return self._conn
+
+    def upsert(self, incident):
+        return self.upsert_many([incident])
+
+    def upsert_many(self, incidents):
+        """
+        Insert or update incidents in a single transaction. Returns the
+        number of incidents that were new or changed.
+        """
+        now = time.time()
+        rows = [to_row(incident) for incident in incidents if incident.incident_id is not None]
+        changed = 0
+        with self._lock, self._conn:
+            for row in rows:
+                current = self._conn.execute(
+                    'SELECT content_sha256, revision FROM incidents WHERE incident_id = ?', (row['incident_id'],)
+                ).fetchone()
+                if current is not None and current['content_sha256'] == row['content_sha256']:
+                    self._conn.execute('UPDATE incidents SET last_seen = ? WHERE incident_id = ?',
+                                       (now, row['incident_id']))
+                    continue
+
+                revision = 1 if current is None else current['revision'] + 1
+                values = [row[column] for column in COLUMNS]
+                if current is None:
+                    self._conn.execute(
+                        'INSERT INTO incidents ({}, revision, first_seen, last_seen, updated_at) '
+                        'VALUES ({}, ?, ?, ?, ?)'.format(', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                        values + [revision, now, now, now]
+                    )
+                else:
+                    self._conn.execute(
+                        'UPDATE incidents SET {}, revision = ?, last_seen = ?, updated_at = ? '
+                        'WHERE incident_id = ?'.format(', '.join('{} = ?'.format(c) for c in COLUMNS[1:])),
+                        values[1:] + [revision, now, now, row['incident_id']]
+                    )
+                self._conn.execute('DELETE FROM incident_characteristics WHERE incident_id = ?',
+                                   (row['incident_id'],))
+                self._conn.executemany(
+                    'INSERT INTO incident_characteristics (incident_id, characteristic) VALUES (?, ?)',
+                    [(row['incident_id'], c) for c in json.loads(row['characteristics'])]
+                )
+                self._conn.execute(
+                    'INSERT INTO revisions (incident_id, revision, content_sha256, data, recorded_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (row['incident_id'], revision, row['content_sha256'], json.dumps(row), now)
+                )
+                changed += 1
+        return changed
+
+    def __decode(self, row):
+        record = dict(row)
+        for column in NESTED:
+            if record.get(column) is not None:
+                record[column] = json.loads(record[column])
+        return record
+
+    def get(self, incident_id):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM incidents WHERE incident_id = ?', (incident_id,)).fetchone()
+        return None if row is None else self.__decode(row)
+
+    def history(self, incident_id):
+        """
+        Every version recorded for an incident, oldest first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT revision, recorded_at, data FROM revisions WHERE incident_id = ? ORDER BY revision',
+                (incident_id,)
+            ).fetchall()
+        history = []
+        for row in rows:
+            data = self.__decode(json.loads(row['data']))
+            data['revision'] = row['revision']
+            data['recorded_at'] = row['recorded_at']
+            history.append(data)
+        return history
+
+    def changed_since(self, timestamp):
+        """
+        Incidents added or modified since `timestamp` (seconds since epoch).
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT * FROM incidents WHERE updated_at >= ? ORDER BY updated_at', (timestamp,)
+            ).fetchall()
+        return [self.__decode(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            # keeps the statistics the query planner picks indexes with up to date
+            self._conn.execute('PRAGMA optimize')
+            self._conn.close()
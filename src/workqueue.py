@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+"""
+Work queue shared by the processes of a distributed crawl.
+
+A coordinator puts the first listing page of every year in the queue and
+workers, on as many hosts as wanted, lease tasks from it: a listing page
+task adds the other listing pages of its year and one task per incident,
+and an incident task fetches the incident page and upserts it into the
+store. Tasks are keyed (listing:<year>:<page>, incident:<id>), so every
+listing page and incident is queued once however many pages list it.
+
+A lease lasts `lease` seconds and the worker renews it while the task runs,
+however long the rate limiter and the retries make it wait. A task whose
+worker died is leased again once its lease expires, and a failed task is
+tried again later, up to `max_attempts` times, so every task is completed
+at least once; handlers must be idempotent, as upserts are.
+
+The queue is a SQLite file, which workers on other hosts can share over a
+network file system for small deployments and tests. WorkQueue is the
+whole interface a server-backed queue would need to provide.
+"""
+
+import collections
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from incident import Incident
+
+
+LEASE = 60  # seconds
+
+MAX_ATTEMPTS = 5
+
+RETRY_DELAY = 30  # seconds before a failed task can be leased again
+
+POLL = 1.0  # seconds between two looks at a queue with nothing to lease
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS tasks ('
+    '  id INTEGER PRIMARY KEY AUTOINCREMENT,'
+    '  kind TEXT NOT NULL,'
+    '  key TEXT NOT NULL UNIQUE,'
+    '  payload TEXT NOT NULL,'
+    "  state TEXT NOT NULL DEFAULT 'pending',"
+    '  attempts INTEGER NOT NULL DEFAULT 0,'
+    '  owner TEXT,'
+    '  available_at REAL NOT NULL DEFAULT 0,'
+    '  created_at REAL NOT NULL,'
+    '  done_at REAL,'
+    '  error TEXT'
+    ')',
+    # pending tasks and leased ones, whose available_at is the lease expiry
+    'CREATE INDEX IF NOT EXISTS tasks_available ON tasks (state, available_at)',
+]
+
+# listing pages first, they are what incident tasks come from
+PRIORITY = "CASE kind WHEN 'listing' THEN 0 ELSE 1 END"
+
+Task = collections.namedtuple('Task', ['id', 'kind', 'key', 'payload', 'attempts'])
+
+
+def listing_key(year, page):
+    return 'listing:{}:{}'.format(year, page)
+
+
+def incident_key(incident_id):
+    return 'incident:{}'.format(incident_id)
+
+
+def worker_name():
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+
+def seed(queue, years):
+    """
+    Queue the first listing page of every year. Returns the number of
+    years that were not queued already.
+    """
+    return queue.add_many([('listing', listing_key(year, 0), {'year': year, 'page': 0}) for year in years])
+
+
+class WorkQueue:
+    """
+    Tasks with leases, in a SQLite file.
+    """
+    def __init__(self, filename, lease=LEASE, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+        self._lease = lease
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+
+    def __transaction(self, work):
+        """
+        Run `work(connection)` in an immediate transaction, so that two
+        workers never lease the same task.
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = work(self._conn)
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+            return result
+
+    def add_many(self, tasks):
+        """
+        Queue (kind, key, payload) tasks, ignoring keys already queued.
+        Returns the number of tasks added.
+        """
+        now = time.time()
+        rows = [(kind, key, json.dumps(payload), now) for kind, key, payload in tasks]
+
+        def add(conn):
+            before = conn.total_changes
+            conn.executemany('INSERT OR IGNORE INTO tasks (kind, key, payload, created_at) VALUES (?, ?, ?, ?)', rows)
+            return conn.total_changes - before
+        return self.__transaction(add)
+
+    def add(self, kind, key, payload):
+        return self.add_many([(kind, key, payload)])
+
+    @property
+    def lease_time(self):
+        return self._lease
+
+    def lease(self, owner, count=1):
+        """
+        Lease up to `count` tasks to `owner`: pending ones and those whose
+        lease expired. A task whose lease expired on its last attempt, its
+        worker dying every time, is given up on instead.
+        """
+        def lease(conn):
+            now = time.time()
+            conn.execute(
+                "UPDATE tasks SET state = 'failed', owner = NULL, error = ? "
+                "WHERE state = 'leased' AND available_at <= ? AND attempts >= ?",
+                ("Lease expired {} times.".format(self._max_attempts), now, self._max_attempts)
+            )
+            rows = conn.execute(
+                "SELECT id, kind, key, payload, attempts FROM tasks "
+                "WHERE state IN ('pending', 'leased') AND available_at <= ? "
+                "ORDER BY {}, id LIMIT ?".format(PRIORITY),
+                (now, count)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET state = 'leased', owner = ?, available_at = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                [(owner, now + self._lease, row[0]) for row in rows]
+            )
+            return [Task(row[0], row[1], row[2], json.loads(row[3]), row[4] + 1) for row in rows]
+        return self.__transaction(lease)
+
+    def extend(self, tasks, owner):
+        """
+        Renew the leases `owner` holds on `tasks`, for `lease` seconds from
+        now.
+        """
+        def extend(conn):
+            conn.executemany(
+                "UPDATE tasks SET available_at = ? WHERE id = ? AND state = 'leased' AND owner = ?",
+                [(time.time() + self._lease, task.id, owner) for task in tasks]
+            )
+        self.__transaction(extend)
+
+    def complete(self, task):
+        """
+        Mark a task done, even if its lease expired meanwhile: the work was
+        done all the same.
+        """
+        self.__transaction(lambda conn: conn.execute(
+            "UPDATE tasks SET state = 'done', done_at = ?, error = NULL WHERE id = ?", (time.time(), task.id)
+        ))
+
+    def fail(self, task, owner, error):
+        """
+        Put a task back in the queue to be tried again after a while, or give
+        up on it after `max_attempts` attempts. Nothing changes if the lease
+        of `owner` expired and the task was leased by someone else since.
+        """
+        state = 'failed' if task.attempts >= self._max_attempts else 'pending'
+        self.__transaction(lambda conn: conn.execute(
+            "UPDATE tasks SET state = ?, owner = NULL, available_at = ?, error = ? "
+            "WHERE id = ? AND state = 'leased' AND owner = ?",
+            (state, time.time() + self._retry_delay, str(error), task.id, owner)
+        ))
+
+    def counts(self):
+        """
+        Number of tasks by (kind, state).
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT kind, state, COUNT(*) FROM tasks GROUP BY kind, state').fetchall()
+        return {(kind, state): count for kind, state, count in rows}
+
+    def unfinished(self):
+        """
+        Number of tasks still pending or leased.
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM tasks WHERE state IN ('pending', 'leased')").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Worker:
+    """
+    Runs `handlers[task.kind](task)` on up to `concurrency` tasks at a time,
+    leasing a new task as soon as one is done and renewing the leases of the
+    running ones every third of the lease time. A handler that returns
+    completes its task and one that raises fails it. The worker stops when
+    the queue holds nothing pending or leased anymore.
+    """
+    def __init__(self, queue, handlers, owner=None, concurrency=1, poll=POLL, logger=None):
+        self._queue = queue
+        self._handlers = handlers
+        self._owner = owner or worker_name()
+        self._concurrency = concurrency
+        self._poll = poll
+        self._logger = logger
+        self.completed = 0
+        self.failed = 0
+
+    def __run_task(self, task):
+        try:
+            self._handlers[task.kind](task)
+        except Exception as ex:
+            if self._logger is not None:
+                self._logger.warning("Task %s failed (attempt %d): %s", task.key, task.attempts, ex)
+            self._queue.fail(task, self._owner, ex)
+            return False
+        self._queue.complete(task)
+        return True
+
+    def run(self):
+        running = {}  # future -> task
+        renewed = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+            while True:
+                if len(running) < self._concurrency:
+                    for task in self._queue.lease(self._owner, self._concurrency - len(running)):
+                        running[executor.submit(self.__run_task, task)] = task
+                if not running:
+                    if not self._queue.unfinished():
+                        break
+                    # the rest is leased by other workers, or waiting to be retried
+                    time.sleep(self._poll)
+                    continue
+                done, _ = wait(running, timeout=self._poll, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    if future.result():
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+                if running and time.monotonic() - renewed >= self._queue.lease_time / 3:
+                    self._queue.extend(list(running.values()), self._owner)
+                    renewed = time.monotonic()
+        return self.completed, self.failed
+
+
+class CrawlTasks:
+    """
+    Handlers of the tasks of a crawl. `crawler(year)` returns the
+    ShootingsCrawler of a year and incidents are upserted into `store`.
+    """
+    def __init__(self, queue, crawler, store, base_url):
+        self._queue = queue
+        self._crawler = crawler
+        self._store = store
+        self._base_url = base_url
+
+    @property
+    def handlers(self):
+        return {'listing': self.listing, 'incident': self.incident}
+
+    def listing(self, task):
+        year, page = task.payload['year'], task.payload['page']
+        rows, pages = self._crawler(year).listing_page(page)
+        tasks = []
+        if page == 0:
+            tasks += [('listing', listing_key(year, i), {'year': year, 'page': i}) for i in range(1, pages + 1)]
+        for row in rows:
+            incident = Incident.from_listing_row(row, self._base_url)
+            key = incident.incident_id if incident.incident_id is not None else incident.incident_link
+            tasks.append(('incident', incident_key(key), {'year': year, 'row': list(row)}))
+        self._queue.add_many(tasks)
+
+    def incident(self, task):
+        incident = Incident.from_listing_row(task.payload['row'], self._base_url)
+        if not self._crawler(task.payload['year']).additional_info(incident):
+            raise Exception("Could not fetch {}.".format(incident.incident_link))
+        self._store.upsert(incident)
@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+
+"""
+Output writers.
+
+CsvWriter keeps the historical CSV layout, where the nested fields are
+written as their Python repr. ColumnarWriter writes a Parquet or Arrow
+file with a real nested schema and typed numeric columns; it needs pyarrow
+(pip install pyarrow) and buffers `batch_size` incidents per row group.
+
+Every output is written to <filename>.part and only renamed to its final
+name once complete, so whoever reads the output directory never sees a
+half-written file. CSV output goes through AtomicFile, which adds a large
+write buffer and optional gzip or zstd compression (zstd needs
+pip install zstandard), and RotatingFile, which starts a new file whenever
+the current one reaches a given size.
+"""
+
+import csv
+import gzip
+import io
+import os
+import shutil
+
+from incident import CSV_HEADER
+
+
+FORMATS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+
+BATCH_SIZE = 10000
+
+COMPRESSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+BUFFER_SIZE = 1024 * 1024
+
+SIZE_CHECK_ROWS = 100  # rows between two looks at the size of a compressed rotating file
+
+PART = '{}.part'
+
+PARTICIPANT_FIELDS = [
+    ('Type', 'type'),
+    ('Name', 'name'),
+    ('Age', 'age'),
+    ('Age Group', 'age_group'),
+    ('Gender', 'gender'),
+    ('Status', 'status'),
+    ('Relationship', 'relationship'),
+]
+
+GUN_FIELDS = [
+    ('Type', 'type'),
+    ('Stolen', 'stolen'),
+]
+
+DISTRICT_FIELDS = [
+    ('Congressional District', 'congressional_district'),
+    ('State Senate District', 'state_senate_district'),
+    ('State House District', 'state_house_district'),
+]
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _struct(data, fields, numeric=()):
+    record = {}
+    for key, name in fields:
+        value = data.get(key)
+        record[name] = _int(value) if name in numeric else value
+    return record
+
+
+def to_record(incident):
+    """
+    Incident as a plain dictionary following the columnar schema.
+    """
+    lat, lon = _float(incident.lat), _float(incident.lon)
+    if not lat and not lon:
+        # the crawler stores 0, 0 when the page has no geolocation
+        lat = lon = None
+
+    return {
+        'sha256': incident.sha256,
+        'incident_id': incident.incident_id,
+        'year': _int(incident.year),
+        'month': _int(incident.month),
+        'day': _int(incident.day),
+        'state': incident.state,
+        'city_or_county': incident.city_or_county,
+        'address': incident.address,
+        'num_killed': _int(incident.num_killed),
+        'num_injured': _int(incident.num_injured),
+        'incident_link': incident.incident_link,
+        'latitude': lat,
+        'longitude': lon,
+        'participants': [_struct(p, PARTICIPANT_FIELDS, numeric=('age',)) for p in incident.participants],
+        'characteristics': list(incident.characteristics),
+        'notes': incident.notes,
+        'guns_involved': [_struct(g, GUN_FIELDS) for g in incident.guns_involved],
+        'district': _struct(incident.district or {}, DISTRICT_FIELDS, numeric=[name for _, name in DISTRICT_FIELDS]),
+    }
+
+
+def schema():
+    import pyarrow as pa
+
+    string = pa.string()
+    return pa.schema([
+        ('sha256', string),
+        ('incident_id', pa.int64()),
+        ('year', pa.int16()),
+        ('month', pa.int8()),
+        ('day', pa.int8()),
+        ('state', pa.dictionary(pa.int16(), string)),
+        ('city_or_county', string),
+        ('address', string),
+        ('num_killed', pa.int32()),
+        ('num_injured', pa.int32()),
+        ('incident_link', string),
+        ('latitude', pa.float64()),
+        ('longitude', pa.float64()),
+        ('participants', pa.list_(pa.struct(
+            [(name, pa.int32() if name == 'age' else string) for _, name in PARTICIPANT_FIELDS]
+        ))),
+        ('characteristics', pa.list_(string)),
+        ('notes', string),
+        ('guns_involved', pa.list_(pa.struct([(name, string) for _, name in GUN_FIELDS]))),
+        ('district', pa.struct([(name, pa.int16()) for _, name in DISTRICT_FIELDS])),
+    ])
+
+
+def split_compression(filename):
+    """
+    (filename without compression extension, compression or None)
+    """
+    for compression, ext in COMPRESSIONS.items():
+        if filename.endswith(ext):
+            return filename[:-len(ext)], compression
+    return filename, None
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("zstd compression needs zstandard (pip install zstandard).")
+    return zstandard
+
+
+def open_text(filename):
+    """
+    Open a text file for reading, decompressing it according to its
+    extension.
+    """
+    _, compression = split_compression(filename)
+    if compression == 'gzip':
+        return gzip.open(filename, 'rt', encoding='utf_8', newline='')
+    if compression == 'zstd':
+        raw = open(filename, 'rb')
+        return io.TextIOWrapper(_zstandard().ZstdDecompressor().stream_reader(raw, closefd=True),
+                                encoding='utf_8', newline='')
+    return open(filename, newline='')
+
+
+def _fsync_directory(filename):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def finalize(part, filename):
+    """
+    Atomically move a complete part file to its final name.
+    """
+    os.replace(part, filename)
+    _fsync_directory(filename)
+
+
+class AtomicFile:
+    """
+    Text file written to <filename>.part through a `buffer_size` buffer,
+    optionally compressed, and moved over <filename> by commit().
+
+    Closing it without commit() keeps the part file, which is what resumed
+    crawls continue from: `resume_at` truncates an existing part file at
+    that offset and goes on writing from there, while `append` starts the
+    part file as a copy of the current <filename>. Offsets only make sense
+    for uncompressed files.
+    """
+    def __init__(self, filename, compression=None, buffer_size=BUFFER_SIZE, resume_at=None, append=False):
+        if compression is not None and compression not in COMPRESSIONS:
+            raise Exception("Unknown compression [{}].".format(compression))
+        if compression is not None and (resume_at is not None or append):
+            raise Exception("Compressed files can not be resumed or appended to.")
+        self.filename = filename
+        self.part = PART.format(filename)
+        self._committed = False
+
+        if resume_at is not None:
+            self._raw = open(self.part, 'r+b', buffering=buffer_size)
+            self._raw.truncate(resume_at)
+            self._raw.seek(resume_at)
+        else:
+            if append and os.path.exists(filename):
+                shutil.copyfile(filename, self.part)
+                self._raw = open(self.part, 'ab', buffering=buffer_size)
+            else:
+                self._raw = open(self.part, 'wb', buffering=buffer_size)
+
+        if compression == 'gzip':
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=6)
+        elif compression == 'zstd':
+            self._stream = _zstandard().ZstdCompressor(level=3).stream_writer(self._raw, closefd=False)
+        else:
+            self._stream = self._raw
+        self._text = io.TextIOWrapper(self._stream, encoding='utf_8', newline='')
+
+    def write(self, text):
+        return self._text.write(text)
+
+    def flush(self):
+        self._text.flush()
+
+    def tell(self):
+        """
+        Bytes written to the part file so far, buffered ones included.
+        """
+        self._text.flush()
+        return self._raw.tell()
+
+    def raw_size(self):
+        """
+        Bytes handed to the part file so far, without flushing anything: it
+        lags behind by what the text buffer and the compressor still hold.
+        """
+        return self._raw.tell()
+
+    def sync(self):
+        """
+        Flush the buffers and make the part file durable. Returns its size.
+        """
+        self._text.flush()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        return self._raw.tell()
+
+    def __close(self):
+        self._text.flush()
+        self._text.detach()
+        if self._stream is not self._raw:
+            # writes the trailer of the compressed stream, the part file stays open
+            self._stream.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+
+    def commit(self):
+        self.__close()
+        finalize(self.part, self.filename)
+        self._committed = True
+
+    def close(self):
+        if not self._committed and not self._raw.closed:
+            self.__close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.close()
+        return False
+
+
+def parse_size(spec):
+    """
+    Number of bytes of a size such as 500000, 64K, 100M or 2G.
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    spec = spec.strip().upper().rstrip('B')
+    try:
+        if spec and spec[-1] in units:
+            size = int(float(spec[:-1]) * units[spec[-1]])
+        else:
+            size = int(spec)
+    except ValueError:
+        raise Exception("Invalid size [{}].".format(spec))
+    if size <= 0:
+        raise Exception("Size [{}] must be positive.".format(spec))
+    return size
+
+
+def part_filename(filename, number):
+    """
+    Name of the n-th rotated file, e.g. output.csv.gz -> output-001.csv.gz
+    """
+    name, compression = split_compression(filename)
+    stem, ext = os.path.splitext(name)
+    return "{}-{:03d}{}{}".format(stem, number, ext, COMPRESSIONS.get(compression, ''))
+
+
+class RotatingFile:
+    """
+    CSV output split in files of about `max_size` bytes each, named after
+    part_filename(). Every file gets the header and is committed as soon as
+    the next one is started.
+
+    Uncompressed files are measured by counting the bytes of the rows.
+    Compressed ones by what the compressor has written, every
+    SIZE_CHECK_ROWS rows: flushing it to know the exact size would end a
+    block per row, and the files would get bigger instead of smaller.
+    """
+    def __init__(self, filename, max_size, compression=None, buffer_size=BUFFER_SIZE):
+        self._filename = filename
+        self._max_size = max_size
+        self._compression = compression
+        self._buffer_size = buffer_size
+        self._number = 0
+        self._file = None
+        self.filenames = []
+        self.__rotate()
+
+    def __rotate(self):
+        if self._file is not None:
+            self._file.commit()
+        self._number += 1
+        self._size = 0
+        self._rows = 0
+        filename = part_filename(self._filename, self._number)
+        self._file = AtomicFile(filename, compression=self._compression, buffer_size=self._buffer_size)
+        self.filenames.append(filename)
+        CsvWriter(self._file).write_header()
+
+    def write(self, text):
+        written = self._file.write(text)
+        if self._compression is None:
+            self._size += len(text.encode('utf_8'))
+        # rows end with a newline: rotate between rows only
+        if text.endswith('\n'):
+            self._rows += 1
+            if self.__full():
+                self.__rotate()
+        return written
+
+    def __full(self):
+        if self._compression is None:
+            return self._size >= self._max_size
+        return self._rows % SIZE_CHECK_ROWS == 0 and self._file.raw_size() >= self._max_size
+
+    def flush(self):
+        self._file.flush()
+
+    def commit(self):
+        self._file.commit()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.close()
+        return False
+
+
+class CsvWriter:
+    def __init__(self, f):
+        self._writer = csv.writer(f)
+
+    def write_header(self):
+        self._writer.writerow(CSV_HEADER)
+
+    def write(self, incident):
+        self._writer.writerow(incident.to_csv())
+
+    def close(self):
+        pass
+
+
+def _open_parquet(filename, schema):
+    import pyarrow.parquet as pq
+    return pq.ParquetWriter(filename, schema, compression='zstd')
+
+
+def _open_arrow(filename, schema):
+    import pyarrow.ipc
+    return pyarrow.ipc.new_file(filename, schema)
+
+
+# columnar format -> function opening a pyarrow writer on a file
+COLUMNAR_OPENERS = {
+    'parquet': _open_parquet,
+    'arrow': _open_arrow,
+}
+
+
+class ColumnarWriter:
+    """
+    Parquet or Arrow writer: buffers records and hands them over to pyarrow
+    one row group at a time.
+    """
+    def __init__(self, fmt, filename, batch_size=BATCH_SIZE):
+        if fmt not in COLUMNAR_OPENERS:
+            raise Exception("Unknown columnar format [{}].".format(fmt))
+        try:
+            import pyarrow
+        except ImportError:
+            raise Exception("Writing {} files needs pyarrow (pip install pyarrow).".format(fmt))
+        self.format = fmt
+        self._pa = pyarrow
+        self._schema = schema()
+        self._filename = filename
+        self._batch_size = batch_size
+        self._records = []
+        self._writer = COLUMNAR_OPENERS[fmt](PART.format(filename), self._schema)
+
+    def write(self, incident):
+        self._records.append(to_record(incident))
+        if len(self._records) >= self._batch_size:
+            self.flush()
+
+    def write_table(self, table):
+        self.flush()
+        self._writer.write_table(table)
+
+    def flush(self):
+        if not self._records:
+            return
+        self._writer.write_table(self._pa.Table.from_pylist(self._records, schema=self._schema))
+        self._records = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+        finalize(PART.format(self._filename), self._filename)
+
+    def abort(self):
+        """
+        Close without publishing the file, its part file is left behind.
+        """
+        self._writer.close()
+
+
+def read_table(fmt, filename):
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_table(filename)
+    import pyarrow.ipc
+    with pyarrow.ipc.open_file(filename) as reader:
+        return reader.read_all()
+
+
+def merge_columnar(fmt, filenames, filename):
+    """
+    Concatenate columnar files into `filename`, dropping incidents already
+    seen in a previous file. Returns the number of incidents written.
+    """
+    import pyarrow as pa
+
+    seen = set()
+    written = 0
+    writer = ColumnarWriter(fmt, filename)
+    try:
+        for name in filenames:
+            table = read_table(fmt, name)
+            keep = []
+            for link in table.column('incident_link').to_pylist():
+                keep.append(link not in seen)
+                seen.add(link)
+            table = table.filter(pa.array(keep, type=pa.bool_()))
+            writer.write_table(table)
+            written += table.num_rows
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return written